@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Times the hot paths (level loading, chunk baking, Player.tick, Game.render
+and the hud) on the shipped levels and on synthetic levels of 1k, 10k and
+100k columns, both as yaml and streamed (.rpls). Runs under the SDL dummy
+video driver, results are JSON.
+
+    python3 benchmarks/bench.py --output bench.json
+    python3 benchmarks/bench.py --baseline bench.json   # exits 1 on regressions
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pygame as pg  # noqa: E402
+
+from ranny_parkour import LEVELS, SCREEN_SIZE, levelcache, streaming  # noqa: E402
+from ranny_parkour.game import Game, Level  # noqa: E402
+from ranny_parkour.headless import Keys, ScriptedKeys  # noqa: E402
+
+SYNTHETIC_COLS = [1_000, 10_000, 100_000]
+REGRESSION_THRESHOLD = 1.25  # slower than baseline by this factor fails
+
+
+def synthetic_level(cols: int, seed: int = 0) -> str:
+    """Yaml for a 10 row level: hills of grass/dirt, some lava pits, coins, a flag at the end."""
+    rng = random.Random(seed)
+    rows = 10
+    grid = [["0"] * cols for _ in range(rows)]
+    height = 2
+    for x in range(cols):
+        if rng.random() < 0.1:
+            height = max(1, min(5, height + rng.choice((-1, 1))))
+        pit = rng.random() < 0.03
+        for y in range(rows - height, rows):
+            grid[y][x] = "3" if pit and y == rows - height else (
+                "1" if y == rows - height else "2")
+        if rng.random() < 0.05:
+            grid[rows - height - 1][x] = "C"
+    grid[rows - 3][cols - 2] = "F"
+    blocks = "\n            ".join("".join(row) for row in grid)
+    return f"""name: "Synthetic {cols}"
+version: "0.0.0"
+data:
+    player:
+        speed: 10
+        jump-power: 14
+        lives: 3
+        starting-pos: [0, 0]
+        respawn-pos: [0, 0]
+    world:
+        background-color: [130, 182, 225]
+        rows: {rows}
+        cols: {cols}
+        blocks: |-
+            {blocks}
+"""
+
+
+def timeit(fn, repeat: int, setup=None) -> dict:
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg) if setup else fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "runs": repeat,
+    }
+
+
+def bench_level(name: str, path: str, win: pg.Surface, repeat: int) -> dict:
+    results = {}
+    big = os.path.getsize(path) > 100_000
+    load_repeat = max(1, repeat // (20 if big else 1))
+
+    if path.endswith(streaming.STREAM_EXT):
+        # mapped as is, there is no yaml or compiled cache to compare
+        results["Level.from_file (streamed)"] = timeit(
+            lambda: Level.from_file(path), load_repeat)
+    else:
+        results["Level.from_file (yaml)"] = timeit(
+            lambda: Level.from_file(path, use_cache=False), load_repeat)
+        Level.from_file(path)  # warm the compiled cache
+        results["Level.from_file (compiled)"] = timeit(
+            lambda: Level.from_file(path), load_repeat)
+
+    level = Level.from_file(path)
+    viewport = pg.Rect(0, 0, *SCREEN_SIZE)
+    chunks = level.static_layer.chunk_range(viewport)
+    results["ChunkedLayer.bake (one screen)"] = timeit(
+        lambda: [level.static_layer.bake(i) for i in chunks], repeat)
+
+    game = Game(prefetch=False)
+    game.set_level(level)
+    keys = ScriptedKeys(Keys.RIGHT)
+
+    def ticks():
+        for i in range(100):
+            keys.mask = Keys.RIGHT | (Keys.JUMP if i % 20 == 0 else 0)
+            game.process_keypresses(keys)
+            game.tick()
+    results["Player.tick (x100)"] = timeit(ticks, repeat)
+
+    results["Game.render"] = timeit(lambda: game.render(win), repeat)
+
+    def invalidate_hud():
+        game.prev_score = None
+        game.prev_level = None
+    results["Game.show_score (changed)"] = timeit(
+        lambda _: game.show_score(win), repeat, invalidate_hud)
+    results["Game.show_score (steady)"] = timeit(
+        lambda: game.show_score(win), repeat)
+    results["Game.show_level_text (changed)"] = timeit(
+        lambda _: game.show_level_text(win), repeat, invalidate_hud)
+    results["Game.show_level_text (steady)"] = timeit(
+        lambda: game.show_level_text(win), repeat)
+
+    return {f"{name}: {key}": value for key, value in results.items()}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median_ms"], result["median_ms"]
+        ratio = after / before if before else 1.0
+        result["baseline_median_ms"] = before
+        result["ratio"] = ratio
+        # sub-microsecond timings are mostly noise
+        if ratio > threshold and after - before > 0.001:
+            regressions.append(
+                f"{name}: {before:.4f}ms -> {after:.4f}ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write results as json here")
+    parser.add_argument("--baseline", help="json from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-cols", type=int, default=max(SYNTHETIC_COLS),
+                        help="skip synthetic levels wider than this")
+    args = parser.parse_args(argv)
+
+    pg.init()
+    win = pg.display.set_mode(SCREEN_SIZE)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        levelcache.CACHE_DIR = os.path.join(tmp, "cache")
+        levels = [(os.path.basename(path), path) for path in LEVELS]
+        for cols in SYNTHETIC_COLS:
+            if cols > args.max_cols:
+                continue
+            path = os.path.join(tmp, f"synthetic_{cols}.yaml")
+            with open(path, "w") as f:
+                f.write(synthetic_level(cols))
+            levels.append((f"synthetic {cols}", path))
+            streamed = os.path.join(tmp, f"synthetic_{cols}.rpls")
+            streaming.compile_yaml(path, streamed)
+            levels.append((f"synthetic {cols} (streamed)", streamed))
+
+        for name, path in levels:
+            results.update(bench_level(name, path, win, args.repeat))
+
+    for name, result in results.items():
+        print(f"{name:<60} {result['median_ms']:>10.4f} ms")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": sys.version.split()[0],
+                "pygame": pg.version.ver,
+                "results": results,
+            }, f, indent=2)
+
+    if regressions:
+        print("\nregressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
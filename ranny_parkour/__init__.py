@@ -11,14 +11,12 @@ def find_base_path():
     return datadir + "/"
 
 
-pg.mixer.pre_init()
-pg.init()
-
 BLOCK_SIZE = 64
 SCREEN_SIZE = SCREEN_WIDTH, SCREEN_HEIGHT = 12*BLOCK_SIZE, 10*BLOCK_SIZE
 COLOR_DEPTH = 32
 FPS = 45
 TITLE = "Ranny Parkour"
+VERSION = "0.2.1"
 BASE_PATH = find_base_path()
 LEVELS = [
     BASE_PATH + "levels/super_ranny.yaml",
@@ -26,14 +24,16 @@ LEVELS = [
 ]
 END_GAME_TEXT = "BRUH"
 
-FONT_SM = pg.font.Font(BASE_PATH + "assets/fonts/LuckiestGuy.ttf", 32)
-FONT_MD = pg.font.Font(BASE_PATH + "assets/fonts/LuckiestGuy.ttf", 50)
-FONT_LG = pg.font.Font(BASE_PATH + "assets/fonts/LuckiestGuy.ttf", 102)
+# nothing is loaded here, see resources.py
+FONT_PATH = BASE_PATH + "assets/fonts/LuckiestGuy.ttf"
+ICON_PATH = BASE_PATH + "assets/icons/icon.png"
+# built things (levels, the atlas) go in a subdirectory each, never the package
+CACHE_PATH = os.environ.get("RANNY_PARKOUR_CACHE") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ranny_parkour")
+FONT_SM = 32
+FONT_MD = 50
+FONT_LG = 102
 
 BLACK = pg.color.Color(0, 0, 0)
 WHITE = pg.color.Color(255, 255, 255)
 TRANSPARENT = pg.color.Color(0, 0, 0, 0)
-
-pg.display.set_mode(SCREEN_SIZE)
-pg.display.set_caption(TITLE)
-pg.display.set_icon(pg.image.load(BASE_PATH + "assets/icons/icon.png"))
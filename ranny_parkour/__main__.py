@@ -1,23 +1,80 @@
+import argparse
+import time
+
 import pygame as pg
 
 from . import *
+from . import resources
 from .game import Game
+from .headless import keys_to_mask
+from .hotreload import LevelWatcher
+from .profiler import FrameTimer
+from .replay import Recorder
+
+# the simulation runs at a fixed rate (FPS ticks a second unless told
+# otherwise), rendering runs as fast as MAX_RENDER_FPS allows and draws the
+# player between ticks. a slow frame runs several ticks before the next render
+# instead of slowing the game down, up to MAX_TICKS_PER_FRAME
+MAX_RENDER_FPS = 120
+MAX_TICKS_PER_FRAME = 5
+
+LOADING_COLOR = pg.color.Color(130, 182, 225)
+LOADING_BAR_SIZE = (6 * BLOCK_SIZE, BLOCK_SIZE // 4)
 
 
 class App:
-    def __init__(self):
-        self.win = pg.display.get_surface()
+    def __init__(self, dirty_rendering=False, record_path: str = None, profile=False, frame_times_path: str = None,
+                 sim_rate: float = FPS, max_fps: int = MAX_RENDER_FPS, interpolate=True, watch=False,
+                 load_jobs: int = None):
+        pg.mixer.pre_init()
+        pg.init()
+
+        self.win = pg.display.set_mode(SCREEN_SIZE)
+        pg.display.set_caption(TITLE)
+        pg.display.set_icon(resources.icon())
         self.clock = pg.time.Clock()
+        self.tick_time = 1.0 / sim_rate
+        self.max_fps = max_fps  # 0 is uncapped
+        self.interpolate = interpolate
 
-        self.game = Game()
+        self.dirty_rendering = dirty_rendering
+        self.game = Game(dirty_rendering)
         self.done = False
 
+        # the first level is built in the background while the art loads
+        self.game.levels.prefetch(LEVELS[0])
+        self.load_assets(load_jobs)
+
+        # reload the level when its file changes
+        self.watcher = LevelWatcher(self.game) if watch else None
+
+        # input recording, restarted whenever the level is reset or switched
+        self.record_path = record_path
+        self.recorder = None
+
+        # frame phase timings, None (and free) unless asked for
+        self.frame_times_path = frame_times_path
+        self.timer = FrameTimer() if profile or frame_times_path else None
+
     def run_loop(self):
         self.game.load_level(0)
         self.game.start()
+        if self.record_path:
+            self.recorder = Recorder(self.game)
 
+        accumulator = 0.0
+        last = time.perf_counter()
         while not self.done:
-            self.clock.tick(FPS)
+            self.clock.tick(self.max_fps)
+            now = time.perf_counter()
+            # past the cap the game slows down rather than spiralling
+            accumulator = min(accumulator + now - last,
+                              MAX_TICKS_PER_FRAME * self.tick_time)
+            last = now
+
+            timer = self.timer
+            if timer:
+                timer.begin()
 
             for e in pg.event.get():
                 if e.type == pg.QUIT:
@@ -25,26 +82,117 @@ class App:
                 elif e.type == pg.KEYDOWN:
                     if e.key == pg.K_n:
                         self.game.reset()
+                        if self.recorder:
+                            self.recorder.start()
+                    elif e.key == pg.K_F3:
+                        self.toggle_overlay()
                     elif e.key in range(pg.K_1, pg.K_9):
                         level_index = e.key - pg.K_1  # hack
-                        self.game.load_level(level_index)
+                        if self.game.load_level(level_index) == 0 and self.recorder:
+                            self.recorder.start()
+
+            if self.watcher:
+                self.watcher.poll()
 
             keys = pg.key.get_pressed()
-            self.game.process_keypresses(keys)
+            if timer:
+                timer.mark()
 
-            self.game.tick()
-            self.game.render(self.win)
+            while accumulator >= self.tick_time:
+                self.game.process_keypresses(keys)
+                self.game.tick()
+                if self.recorder:
+                    self.recorder.record(keys_to_mask(keys))
+                accumulator -= self.tick_time
+            if timer:
+                timer.mark()
 
+            self.game.update_hud()
+            if timer:
+                timer.mark()
+
+            overlay = timer and timer.overlay_visible
+            if overlay and timer.overlay_rect:
+                self.game.invalidate(timer.overlay_rect)
+            alpha = accumulator / self.tick_time if self.interpolate else 1.0
+            dirty = self.game.render(self.win, alpha)
+            if overlay:
+                dirty.append(timer.draw_overlay(self.win))
+            if timer:
+                timer.mark()
+
+            if self.dirty_rendering:
+                pg.display.update(dirty)
+            else:
+                pg.display.flip()
+            if timer:
+                timer.mark()
+                timer.end()
+
+    def load_assets(self, jobs: int = None):
+        # decoding happens on a thread pool, this keeps a loading screen up meanwhile
+        preloader = resources.Preloader(jobs)
+        text = resources.font(FONT_SM).render("Loading...", True, BLACK)
+        bar = pg.Rect((0, 0), LOADING_BAR_SIZE)
+        bar.center = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + BLOCK_SIZE // 2)
+
+        while not preloader.step():
+            for e in pg.event.get():
+                if e.type == pg.QUIT:
+                    return self.quit()
+            self.win.fill(LOADING_COLOR)
+            self.win.blit(text, text.get_rect(
+                midbottom=(bar.centerx, bar.top - BLOCK_SIZE // 4)))
+            pg.draw.rect(self.win, WHITE, bar)
+            pg.draw.rect(self.win, BLACK, (bar.topleft, (int(
+                bar.width * preloader.progress), bar.height)))
             pg.display.flip()
 
+    def toggle_overlay(self):
+        if not self.timer:
+            self.timer = FrameTimer()
+        elif self.timer.overlay_visible and self.timer.overlay_rect:
+            # clean up where the overlay was
+            self.game.invalidate(self.timer.overlay_rect)
+        self.timer.toggle_overlay()
+
     def quit(self):
         self.done = True
+        if self.recorder:
+            self.recorder.finish().save(self.record_path)
+        if self.timer and self.frame_times_path:
+            self.timer.dump_csv(self.frame_times_path)
         pg.quit()
         raise SystemExit
 
 
-def main():
-    app = App()
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="ranny-parkour")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only redraw and update the parts of the screen that changed")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record the inputs of the current attempt, see ranny_parkour.replay")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every frame, F3 shows the overlay")
+    parser.add_argument("--frame-times", metavar="PATH",
+                        help="write per-frame phase timings as csv on exit (implies --profile)")
+    parser.add_argument("--sim-rate", type=float, default=FPS,
+                        help=f"simulation ticks per second (default {FPS}), changes the game speed")
+    parser.add_argument("--max-fps", type=int, default=MAX_RENDER_FPS,
+                        help=f"render frame cap (default {MAX_RENDER_FPS}, 0 for none)")
+    parser.add_argument("--no-interpolation", action="store_true",
+                        help="draw the last tick as is instead of between ticks")
+    parser.add_argument("--watch", action="store_true",
+                        help="reload the current level whenever its file is saved")
+    parser.add_argument("--load-jobs", type=int, default=None,
+                        help="threads decoding the art at startup (default: one per cpu)")
+    args, _ = parser.parse_known_args(argv)
+
+    app = App(dirty_rendering=args.dirty_rects, record_path=args.record,
+              profile=args.profile, frame_times_path=args.frame_times,
+              sim_rate=args.sim_rate, max_fps=args.max_fps,
+              interpolate=not args.no_interpolation, watch=args.watch,
+              load_jobs=args.load_jobs)
     app.run_loop()
 
 
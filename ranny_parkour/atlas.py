@@ -0,0 +1,246 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import pygame as pg
+
+from . import *
+from . import resources
+from .misc import convert
+
+# every sprite the game draws (see game.sprite_spec), already scaled and
+# flipped, packed into one png with a json index. startup then decodes one
+# image instead of scaling and flipping dozens. the prebuilt atlas ships in
+# the package; when it is missing or stale (new art, changed spec) the game
+# builds one and keeps it in the user cache, never in the package itself
+#
+#   python -m ranny_parkour.atlas          (build, done by scripts/build.sh)
+#   python -m ranny_parkour.atlas --check
+
+ATLAS_DIR = BASE_PATH + "assets/atlas/"  # prebuilt
+CACHE_DIR = os.path.join(CACHE_PATH, "atlas")
+INDEX_NAME = "atlas.json"
+ATLAS_WIDTH = 1024
+FORMAT_VERSION = 2
+
+
+def frame_key(loader: str, args: tuple) -> str:
+    return json.dumps([loader, *args])
+
+
+def spec_hash(spec: list[tuple[str, tuple]]) -> str:
+    return hashlib.sha1(json.dumps(spec).encode()).hexdigest()
+
+
+def sources(spec: list[tuple[str, tuple]]) -> list[str]:
+    return sorted({args[0] for _, args in spec})
+
+
+def file_info(path: str) -> dict:
+    stat = os.stat(BASE_PATH + path)
+    with open(BASE_PATH + path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": digest}
+
+
+class Atlas:
+    def __init__(self, surface: pg.Surface, frames: dict[str, list[list[int]]]):
+        self.surface = surface
+        self.frames = frames
+
+    def get(self, loader: str, args: tuple) -> list[pg.Surface] | None:
+        rects = self.frames.get(frame_key(loader, args))
+        if rects is None:
+            return None
+        return [self.surface.subsurface(rect) for rect in rects]
+
+
+def pack(sizes: list[tuple[int, int]], width: int = ATLAS_WIDTH) -> tuple[list[pg.Rect], int]:
+    """Shelf packing, tallest first. Returns a rect per size (in input order) and the atlas height."""
+    rects = [None] * len(sizes)
+    x = y = shelf = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x + w > width:
+            x, y, shelf = 0, y + shelf, 0
+        rects[i] = pg.Rect(x, y, w, h)
+        x += w
+        shelf = max(shelf, h)
+    return rects, y + shelf
+
+
+def build(spec: list[tuple[str, tuple]] = None, images: list[list[pg.Surface]] = None) -> Atlas:
+    """`images` are the already loaded frames of each spec entry, loaded here if not given."""
+    if spec is None:
+        from .game import sprite_spec
+        spec = sprite_spec()
+
+    keys = [frame_key(loader, args) for loader, args in spec]
+    if images is None:
+        images = []
+        for loader, args in spec:
+            frames = getattr(resources, f"load_{loader}")(*args)
+            images.append([frames] if isinstance(frames, pg.Surface) else frames)
+
+    flat = [image for frames in images for image in frames]
+    rects, height = pack([image.get_size() for image in flat])
+    surface = pg.Surface((ATLAS_WIDTH, height), pg.SRCALPHA, COLOR_DEPTH)
+    surface.fill(TRANSPARENT)
+    for image, rect in zip(flat, rects):
+        # max onto transparent copies rgba exactly instead of blending
+        surface.blit(image, rect, special_flags=pg.BLEND_RGBA_MAX)
+
+    frames, i = {}, 0
+    for key, group in zip(keys, images):
+        frames[key] = [list(rect) for rect in rects[i:i + len(group)]]
+        i += len(group)
+    return Atlas(convert(surface), frames)
+
+
+def save(built: Atlas, spec: list[tuple[str, tuple]], directory: str):
+    """
+    Writes `built` to `directory`. The image is named after its contents and
+    the index (which names it) is replaced last, both through temp files, so
+    readers in other processes only ever see a matching pair.
+    """
+    digest = hashlib.sha1(pg.image.tobytes(built.surface, "RGBA")).hexdigest()
+    image = f"atlas-{digest[:16]}.png"
+    index = {
+        "version": FORMAT_VERSION,
+        "spec": spec_hash(spec),
+        "sources": {path: file_info(path) for path in sources(spec)},
+        "image": image,
+        "frames": built.frames,
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, image)
+    tmp = os.path.join(directory, f"atlas.{os.getpid()}.{threading.get_ident()}.tmp")
+    pg.image.save(built.surface, tmp + ".png")
+    os.replace(tmp + ".png", path)
+    with open(tmp + ".json", "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp + ".json", os.path.join(directory, INDEX_NAME))
+
+    for name in os.listdir(directory):
+        if name.startswith("atlas-") and name.endswith(".png") and name != image:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass  # still open somewhere
+
+
+def cache(built: Atlas, spec: list[tuple[str, tuple]]):
+    # best effort, without a writable cache the atlas is rebuilt every start
+    try:
+        save(built, spec, CACHE_DIR)
+    except (OSError, pg.error):
+        pass
+
+
+def is_fresh(index: dict, spec: list[tuple[str, tuple]]) -> bool:
+    if index.get("version") != FORMAT_VERSION or index.get("spec") != spec_hash(spec):
+        return False
+    recorded = index.get("sources", {})
+    if sorted(recorded) != sources(spec):
+        return False
+    for path, info in recorded.items():
+        try:
+            stat = os.stat(BASE_PATH + path)
+        except OSError:
+            return False
+        if stat.st_mtime_ns == info["mtime_ns"] and stat.st_size == info["size"]:
+            continue
+        # touched, only stale if the contents changed
+        if file_info(path)["sha1"] != info["sha1"]:
+            return False
+    return True
+
+
+def fresh_index(spec: list[tuple[str, tuple]], directory: str) -> dict | None:
+    """The index in `directory` if the atlas there is up to date with `spec`."""
+    try:
+        with open(os.path.join(directory, INDEX_NAME)) as f:
+            index = json.load(f)
+        if is_fresh(index, spec):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def find(spec: list[tuple[str, tuple]]) -> tuple[dict, str] | None:
+    """(index, image path) of an up to date atlas, the prebuilt one first."""
+    for directory in (ATLAS_DIR, CACHE_DIR):
+        index = fresh_index(spec, directory)
+        if index is not None and isinstance(index.get("image"), str) and "frames" in index:
+            return index, os.path.join(directory, index["image"])
+    return None
+
+
+def load() -> Atlas:
+    """An up to date atlas from disk, otherwise a freshly built (and cached) one."""
+    from .game import sprite_spec
+    spec = sprite_spec()
+    found = find(spec)
+    if found is not None:
+        index, image = found
+        try:
+            return Atlas(convert(pg.image.load(image)), index["frames"])
+        except (OSError, KeyError, pg.error):
+            pass
+    built = build(spec)
+    cache(built, spec)
+    return built
+
+
+atlas: Atlas | None = None
+atlas_lock = threading.Lock()
+
+
+def get() -> Atlas:
+    global atlas
+    with atlas_lock:
+        if atlas is None:
+            atlas = load()
+        return atlas
+
+
+def install(new: Atlas):
+    """Use an atlas loaded elsewhere (see resources.Preloader)."""
+    global atlas
+    with atlas_lock:
+        atlas = new
+
+
+def clear():
+    global atlas
+    with atlas_lock:
+        atlas = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.atlas", description="build the sprite atlas")
+    parser.add_argument("--check", action="store_true",
+                        help="only report whether the atlas is up to date")
+    args = parser.parse_args(argv)
+
+    from .game import sprite_spec
+    spec = sprite_spec()
+    if args.check:
+        fresh = fresh_index(spec, ATLAS_DIR) is not None
+        print("atlas is up to date" if fresh else "atlas is stale")
+        raise SystemExit(0 if fresh else 1)
+
+    built = build(spec)
+    save(built, spec, ATLAS_DIR)
+    count = sum(len(rects) for rects in built.frames.values())
+    print(f"packed {count} frames into {ATLAS_DIR} "
+          f"({built.surface.get_width()}x{built.surface.get_height()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import time
+
+import numpy as np
+
+from . import *
+from .game import (Block, Game, Level, Player, PLAYER_SIZE, TILE_COIN,
+                   TILE_EMPTY, TILE_ENDPOINT)
+from .headless import Keys, ScriptedKeys
+
+# steps many players through the same level at once. every agent follows the
+# exact rules of Game.process_keypresses + Player.tick (including pygame's
+# rounding of float rect coordinates), just on numpy arrays instead of sprites
+#
+#   python -m ranny_parkour.batch --level 0 --agents 2000 --ticks 1000 --verify 16
+
+PLAYER_W, PLAYER_H = PLAYER_SIZE
+
+# how many cells a player rect can overlap along each axis
+SPAN_COLS = (PLAYER_W - 1) // BLOCK_SIZE + 2
+SPAN_ROWS = (PLAYER_H - 1) // BLOCK_SIZE + 2
+
+IDLE = Player.State.IDLE
+WALKING = Player.State.WALKING
+JUMPING = Player.State.JUMPING
+
+
+def round_rect(values: np.ndarray) -> np.ndarray:
+    # pygame rounds floats assigned to rect coordinates half away from zero
+    return (np.sign(values) * np.floor(np.abs(values) + 0.5)).astype(np.int64)
+
+
+class BatchSim:
+    def __init__(self, level: Level, n: int, track_coins=True):
+        self.level = level
+        self.n = n
+        self.track_coins = track_coins  # off for searches that only care about movement
+
+        self.tiles = np.frombuffer(level.tile_grid(), dtype=np.uint8).reshape(
+            level.rows, level.cols)
+        self.solid = (self.tiles > TILE_EMPTY) & (self.tiles < TILE_COIN)
+        self.lava = self.tiles == Block.BlockType.LAVA
+
+        # coins and endpoints sit exactly on cells, so they are found with the same cell lookup
+        coin_cells = level.tile_cells(TILE_COIN)
+        self.coin_count = len(coin_cells)
+        self.coin_ids = np.full((level.rows, level.cols), -1, dtype=np.int32)
+        for i, (row, col) in enumerate(coin_cells):
+            self.coin_ids[row, col] = i
+        self.endpoints = self.tiles == TILE_ENDPOINT
+
+        self.reset()
+
+    def reset(self):
+        n, level = self.n, self.level
+        start_x, start_y = level.player_starting_pos
+        self.x = np.full(n, start_x, dtype=np.int64)
+        self.y = np.full(n, start_y, dtype=np.int64)
+        self.vx = np.zeros(n)
+        self.vy = np.zeros(n)
+        self.grounded = np.zeros(n, dtype=bool)
+        self.facing_right = np.ones(n, dtype=bool)
+        self.state = np.full(n, IDLE, dtype=np.int8)
+        self.lives = np.full(n, level.player_lives, dtype=np.int64)
+        self.coins_collected = np.zeros(n, dtype=np.int64)
+        self.coins = np.ones((n, self.coin_count if self.track_coins else 0), dtype=bool)
+        self.won = np.zeros(n, dtype=bool)
+
+    def load(self, x: np.ndarray, y: np.ndarray, vx: np.ndarray, vy: np.ndarray, grounded: np.ndarray, state: np.ndarray):
+        """Replaces the agents with ones in the given movement states (full lives, no coins)."""
+        self.n = len(x)
+        self.reset()
+        self.x, self.y = x.astype(np.int64), y.astype(np.int64)
+        self.vx, self.vy = vx.astype(np.float64), vy.astype(np.float64)
+        self.grounded = grounded.astype(bool)
+        self.state = state.astype(np.int8)
+
+    def cells(self):
+        """Yields (row, col, overlaps) for every cell a player may overlap, in row-major order."""
+        x, y = self.x, self.y
+        left, right = x // BLOCK_SIZE, (x + PLAYER_W - 1) // BLOCK_SIZE
+        top, bottom = y // BLOCK_SIZE, (y + PLAYER_H - 1) // BLOCK_SIZE
+        rows, cols = self.tiles.shape
+        for i in range(SPAN_ROWS):
+            row = top + i
+            row_ok = (row <= bottom) & (row >= 0) & (row < rows)
+            row = np.clip(row, 0, rows - 1)
+            for j in range(SPAN_COLS):
+                col = left + j
+                ok = row_ok & (col <= right) & (col >= 0) & (col < cols)
+                yield row, np.clip(col, 0, cols - 1), ok
+
+    def process_keypresses(self, masks: np.ndarray):
+        level = self.level
+        jump = (masks & Keys.JUMP).astype(bool) & self.grounded
+        self.grounded &= ~jump
+        self.vy = np.where(jump, -level.player_jump_power, self.vy)
+
+        left = (masks & Keys.LEFT).astype(bool)
+        right = (masks & Keys.RIGHT).astype(bool) & ~left
+        stop = ~left & ~right & (self.state != JUMPING)
+        self.vx = np.where(left, -level.player_speed,
+                           np.where(right, level.player_speed, np.where(stop, 0.0, self.vx)))
+        self.facing_right = np.where(
+            left, False, np.where(right, True, self.facing_right))
+
+    def tick(self):
+        level = self.level
+
+        # gravity
+        self.vy = np.minimum(self.vy + level.gravity, level.terminal_velocity)
+
+        # horizontal, every overlap is found first and the last one in row-major order wins
+        self.x = round_rect(self.x + self.vx)
+        hits = [(col, ok & self.solid[row, col])
+                for row, col, ok in self.cells()]
+        for col, hit in hits:
+            self.x = np.where(hit & (self.vx > 0), col * BLOCK_SIZE - PLAYER_W,
+                              np.where(hit & (self.vx < 0), (col + 1) * BLOCK_SIZE, self.x))
+
+        # vertical, lava kills on the spot, otherwise the first hit lands/bonks
+        self.grounded = np.zeros(self.n, dtype=bool)
+        self.y = round_rect(self.y + self.vy)
+        hits = [(row, ok & self.solid[row, col], self.lava[row, col])
+                for row, col, ok in self.cells()]
+        alive = np.ones(self.n, dtype=bool)
+        respawn_x, respawn_y = level.player_respawn_pos
+        for row, hit, lava in hits:
+            hit = hit & alive
+            die = hit & lava
+            self.lives -= die
+            self.x = np.where(die, respawn_x, self.x)
+            self.y = np.where(die, respawn_y, self.y)
+            alive &= ~die
+
+            land = hit & ~lava & (self.vy > 0)
+            bonk = hit & ~lava & (self.vy < 0)
+            self.y = np.where(land, row * BLOCK_SIZE - PLAYER_H,
+                              np.where(bonk, (row + 1) * BLOCK_SIZE, self.y))
+            self.vy = np.where(land | bonk, 0.0, self.vy)
+            self.grounded |= land
+
+        # coins and endpoints
+        agents = np.arange(self.n)
+        for row, col, ok in self.cells():
+            coin = self.coin_ids[row, col]
+            has_coin = ok & (coin >= 0)
+            if self.track_coins and has_coin.any():
+                coin = np.maximum(coin, 0)
+                take = has_coin & self.coins[agents, coin]
+                self.coins[agents[take], coin[take]] = False
+                self.coins_collected += take
+            self.won |= ok & self.endpoints[row, col]
+
+        # world boundaries
+        self.x = np.where(self.x < 0, 0, np.where(
+            self.x + PLAYER_W > level.width, level.width - PLAYER_W, self.x))
+
+        # state
+        new_state = np.where(self.vx != 0, WALKING, IDLE)
+        jumping = ~self.grounded & ((self.vy < 0) | (self.state == JUMPING))
+        self.state = np.where(jumping, JUMPING, new_state).astype(np.int8)
+
+    def step(self, masks: np.ndarray):
+        self.process_keypresses(np.asarray(masks, dtype=np.uint8))
+        self.tick()
+
+    def agent(self, i: int) -> dict:
+        return {
+            "x": int(self.x[i]),
+            "y": int(self.y[i]),
+            "vx": float(self.vx[i]),
+            "vy": float(self.vy[i]),
+            "grounded": bool(self.grounded[i]),
+            "state": int(self.state[i]),
+            "lives": int(self.lives[i]),
+            "coins_collected": int(self.coins_collected[i]),
+            "won": bool(self.won[i]),
+        }
+
+
+def game_agent(game: Game) -> dict:
+    p = game.player
+    return {
+        "x": p.rect.x,
+        "y": p.rect.y,
+        "vx": float(p.vx),
+        "vy": float(p.vy),
+        "grounded": p.grounded,
+        "state": int(p.state),
+        "lives": p.lives,
+        "coins_collected": p.coins_collected,
+        "won": bool(game.flags & Game.Flags.WIN),
+    }
+
+
+def random_inputs(rng: np.random.Generator, ticks: int, n: int, hold=0.9) -> np.ndarray:
+    """(ticks, n) key masks, each agent keeps its keys for a while before picking new ones."""
+    masks = np.empty((ticks, n), dtype=np.uint8)
+    current = rng.integers(0, 8, n, dtype=np.uint8)
+    for t in range(ticks):
+        change = rng.random(n) > hold
+        current = np.where(change, rng.integers(
+            0, 8, n, dtype=np.uint8), current)
+        masks[t] = current
+    return masks
+
+
+def verify(level_index: int, inputs: np.ndarray, agents: list[int]) -> list[str]:
+    """Replays `agents` through the real Game and returns any tick where they disagree."""
+    game = Game(prefetch=False)
+    game.load_level(level_index)
+    sim = BatchSim(game.level, inputs.shape[1])
+    keys = ScriptedKeys()
+    snapshots = {}
+    errors = []
+
+    for i in agents:
+        game.reset()
+        snapshots[i] = []
+        for masks in inputs:
+            keys.mask = int(masks[i])
+            game.process_keypresses(keys)
+            game.tick()
+            snapshots[i].append(game_agent(game))
+
+    for t, masks in enumerate(inputs):
+        sim.step(masks)
+        for i in agents:
+            expected, got = snapshots[i][t], sim.agent(i)
+            if expected != got:
+                errors.append(f"agent {i} tick {t}: {expected} != {got}")
+                agents = [a for a in agents if a != i]
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.batch", description="step many players through a level at once")
+    parser.add_argument("--level", type=int, default=0)
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify", type=int, default=0,
+                        help="also run this many agents through Game and compare every tick")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    inputs = random_inputs(rng, args.ticks, args.agents)
+    level = Level.from_file(LEVELS[args.level])
+    sim = BatchSim(level, args.agents)
+
+    start = time.perf_counter()
+    for masks in inputs:
+        sim.step(masks)
+    elapsed = time.perf_counter() - start
+    agent_ticks = args.agents * args.ticks
+    print(f"{args.agents} agents x {args.ticks} ticks in {elapsed:.3f}s "
+          f"({agent_ticks / elapsed:.0f} agent ticks/s), {int(sim.won.sum())} won")
+
+    if args.verify:
+        errors = verify(args.level, inputs, list(
+            range(min(args.verify, args.agents))))
+        for error in errors:
+            print(error)
+        print(f"verified {args.verify} agents against Game: "
+              f"{'ok' if not errors else f'{len(errors)} mismatches'}")
+        if errors:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
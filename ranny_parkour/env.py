@@ -0,0 +1,276 @@
+import argparse
+import multiprocessing as mp
+import os
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from . import *
+from .game import Game, TILE_COIN, TILE_EMPTY
+from .headless import Keys, ScriptedKeys
+
+# gym-style environments for training bots, no gym dependency.
+#
+#   env = ParkourEnv(0)
+#   obs, info = env.reset()
+#   obs, reward, terminated, truncated, info = env.step(action)
+#
+# VecEnv runs many of them across worker processes and hands back
+# observations through shared memory
+#
+#   python -m ranny_parkour.env --envs 32 --workers 4 --steps 2000
+
+ACTIONS = [
+    Keys.NONE,
+    Keys.LEFT,
+    Keys.RIGHT,
+    Keys.JUMP,
+    Keys.JUMP | Keys.LEFT,
+    Keys.JUMP | Keys.RIGHT,
+]
+
+# tiles around the player, player in the middle
+OBS_ROWS = 11
+OBS_COLS = 15
+
+COIN_REWARD = 1.0
+WIN_REWARD = 10.0
+DEATH_PENALTY = 1.0
+
+
+class ParkourEnv:
+    def __init__(self, level_index: int = 0, max_steps: int = 3000, obs_shape: tuple[int, int] = (OBS_ROWS, OBS_COLS)):
+        self.level_index = level_index
+        self.max_steps = max_steps
+        self.obs_shape = obs_shape
+        self.action_count = len(ACTIONS)
+
+        self.game = Game(prefetch=False)
+        if self.game.load_level(level_index) < 0:
+            raise IndexError(f"no level with index {level_index}")
+        self.keys = ScriptedKeys()
+        self.level = self.game.level
+
+        # level tiles padded with empty cells so windows never go out of bounds
+        level = self.level
+        rows, cols = obs_shape
+        self.pad_y, self.pad_x = rows // 2, cols // 2
+        tiles = np.frombuffer(level.tile_grid(), dtype=np.uint8).reshape(
+            level.rows, level.cols)
+        self.grid = np.pad(tiles, ((self.pad_y, self.pad_y), (self.pad_x, self.pad_x)),
+                           constant_values=TILE_EMPTY)
+        self.coin_cells = [(row + self.pad_y, col + self.pad_x)
+                           for row, col in level.tile_cells(TILE_COIN)]
+        self.steps = 0
+
+    def observation(self) -> np.ndarray:
+        rect = self.game.player.rect
+        # with the padding, the window starting at the player's cell is centered on it
+        row = min(max(rect.centery // BLOCK_SIZE, 0), self.level.rows - 1)
+        col = min(max(rect.centerx // BLOCK_SIZE, 0), self.level.cols - 1)
+        rows, cols = self.obs_shape
+        return self.grid[row:row + rows, col:col + cols].copy()
+
+    def info(self) -> dict:
+        p = self.game.player
+        return {
+            "pos": (p.rect.x, p.rect.y),
+            "lives": p.lives,
+            "coins": p.coins_collected,
+            "won": bool(self.game.flags & Game.Flags.WIN),
+            "steps": self.steps,
+        }
+
+    def sync_coins(self):
+        # collected coins disappear from the observation
+        mask = self.level.coin_mask()
+        for i, (row, col) in enumerate(self.coin_cells):
+            self.grid[row, col] = TILE_COIN if mask >> i & 1 else TILE_EMPTY
+
+    def reset(self, seed=None) -> tuple[np.ndarray, dict]:
+        self.game.reset()
+        self.sync_coins()
+        self.steps = 0
+        return self.observation(), self.info()
+
+    def step(self, action: int) -> tuple[np.ndarray, float, bool, bool, dict]:
+        game, player = self.game, self.game.player
+        coins, lives = player.coins_collected, player.lives
+
+        self.keys.mask = ACTIONS[action]
+        game.process_keypresses(self.keys)
+        game.tick()
+        self.steps += 1
+
+        won = bool(game.flags & Game.Flags.WIN)
+        # there is no game over and falling below the level never respawns,
+        # so an episode ends with the last life or the fall, the fall a death
+        fell = player.rect.top > game.level.height
+        reward = (player.coins_collected - coins) * COIN_REWARD \
+            - (lives - player.lives + fell) * DEATH_PENALTY \
+            + (WIN_REWARD if won else 0.0)
+        if player.coins_collected != coins:
+            self.sync_coins()
+
+        terminated = won or fell or player.lives <= 0
+        truncated = not terminated and self.steps >= self.max_steps
+        return self.observation(), reward, terminated, truncated, self.info()
+
+
+# ==================
+# Vectorized
+# ==================
+
+def worker(conn, env_ids: list[int], level_indices: list[int], env_kwargs: dict, shm_names: dict, num_envs: int, obs_shape):
+    shms = {key: SharedMemory(name) for key, name in shm_names.items()}
+    obs = np.ndarray((num_envs, *obs_shape), np.uint8, shms["obs"].buf)
+    rewards = np.ndarray(num_envs, np.float64, shms["rewards"].buf)
+    terminated = np.ndarray(num_envs, np.bool_, shms["terminated"].buf)
+    truncated = np.ndarray(num_envs, np.bool_, shms["truncated"].buf)
+
+    envs = [ParkourEnv(level_indices[i], obs_shape=obs_shape, **env_kwargs)
+            for i in env_ids]
+    try:
+        while True:
+            cmd, data = conn.recv()
+            if cmd == "reset":
+                infos = []
+                for i, env in zip(env_ids, envs):
+                    obs[i], info = env.reset()
+                    infos.append(info)
+                conn.send(infos)
+            elif cmd == "step":
+                infos = []
+                for i, env, action in zip(env_ids, envs, data):
+                    ob, rewards[i], terminated[i], truncated[i], info = env.step(
+                        action)
+                    if terminated[i] or truncated[i]:
+                        # auto reset, the last observation goes back in info
+                        info["final_observation"] = ob
+                        ob, _ = env.reset()
+                    obs[i] = ob
+                    infos.append(info)
+                conn.send(infos)
+            elif cmd == "close":
+                break
+    finally:
+        del obs, rewards, terminated, truncated
+        for shm in shms.values():
+            shm.close()
+        conn.close()
+
+
+class VecEnv:
+    """
+    `num_envs` ParkourEnvs split across `workers` processes. Observations,
+    rewards and done flags live in shared memory, only actions and info
+    dicts go through pipes. Finished environments are reset automatically.
+    """
+
+    def __init__(self, num_envs: int, level_indices: list[int] = None, workers: int = None,
+                 obs_shape: tuple[int, int] = (OBS_ROWS, OBS_COLS), **env_kwargs):
+        self.num_envs = num_envs
+        self.obs_shape = obs_shape
+        self.action_count = len(ACTIONS)
+        level_indices = level_indices or [
+            i % len(LEVELS) for i in range(num_envs)]
+        workers = max(1, min(workers or os.cpu_count() or 1, num_envs))
+
+        sizes = {
+            "obs": num_envs * obs_shape[0] * obs_shape[1],
+            "rewards": num_envs * 8,
+            "terminated": num_envs,
+            "truncated": num_envs,
+        }
+        self.shms = {key: SharedMemory(create=True, size=size)
+                     for key, size in sizes.items()}
+        self.obs = np.ndarray((num_envs, *obs_shape),
+                              np.uint8, self.shms["obs"].buf)
+        self.rewards = np.ndarray(num_envs, np.float64,
+                                  self.shms["rewards"].buf)
+        self.terminated = np.ndarray(
+            num_envs, np.bool_, self.shms["terminated"].buf)
+        self.truncated = np.ndarray(
+            num_envs, np.bool_, self.shms["truncated"].buf)
+
+        shm_names = {key: shm.name for key, shm in self.shms.items()}
+        self.shards = [ids.tolist() for ids in np.array_split(
+            np.arange(num_envs), workers)]
+        self.conns = []
+        self.procs = []
+        for ids in self.shards:
+            parent, child = mp.Pipe()
+            proc = mp.Process(target=worker, args=(child, ids, level_indices, env_kwargs,
+                                                   shm_names, num_envs, obs_shape), daemon=True)
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+
+    def gather(self) -> list[dict]:
+        infos = []
+        for conn in self.conns:
+            infos.extend(conn.recv())
+        return infos
+
+    def reset(self) -> tuple[np.ndarray, list[dict]]:
+        for conn in self.conns:
+            conn.send(("reset", None))
+        infos = self.gather()
+        return self.obs.copy(), infos
+
+    def step(self, actions) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+        actions = np.asarray(actions)
+        for conn, ids in zip(self.conns, self.shards):
+            conn.send(("step", actions[ids].tolist()))
+        infos = self.gather()
+        return self.obs.copy(), self.rewards.copy(), self.terminated.copy(), self.truncated.copy(), infos
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self.procs:
+            proc.join(timeout=5)
+        del self.obs, self.rewards, self.terminated, self.truncated
+        for shm in self.shms.values():
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.env", description="measure environment throughput")
+    parser.add_argument("--envs", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    with VecEnv(args.envs, workers=args.workers) as env:
+        env.reset()
+        start = time.perf_counter()
+        total_reward = 0.0
+        for _ in range(args.steps):
+            _, rewards, *_ = env.step(rng.integers(0,
+                                                   env.action_count, args.envs))
+            total_reward += rewards.sum()
+        elapsed = time.perf_counter() - start
+
+    steps = args.envs * args.steps
+    print(f"{args.envs} envs on {len(env.shards)} workers: {steps} steps in {elapsed:.3f}s "
+          f"({steps / elapsed:.0f} steps/s), total reward {total_reward:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
+import hashlib
+import json
+import os
 import pygame as pg
-import yaml
+import re
 from enum import IntEnum
+from functools import cache, cached_property
+from typing import NamedTuple
 
 from . import *
-from .misc import load_image, SpriteSheet
+from . import levelcache, resources
+from .layers import ChunkedLayer
+from .resources import LazyImage
+from .spatial import SpatialGroup
+from .misc import LRUCache
 from .widgets import Text
 
 # welcome, adventurer, to the land of spagetti code
@@ -11,31 +20,32 @@ from .widgets import Text
 PLAYER_WIDTH = BLOCK_SIZE
 PLAYER_HEIGHT = 1.8*BLOCK_SIZE
 
-# ranny idle
-PLAYER_IDLE_IMAGE_RIGHT = pg.transform.scale(pg.image.load(
-    BASE_PATH+"assets/sprites/ranny_silouette.png"), (PLAYER_WIDTH, PLAYER_HEIGHT)).convert_alpha()
-PLAYER_IDLE_IMAGE_LEFT = pg.transform.flip(
-    PLAYER_IDLE_IMAGE_RIGHT, 1, 0).convert_alpha()
-
-# ranny walking
-RANNY_SHEET_1 = SpriteSheet(BASE_PATH + "assets/sprites/ranny_spritesheet_1.png")  # noqa
-
-PLAYER_WALKING_IMAGES_RIGHT = list(map(
-    lambda image: pg.transform.scale(
-        image, (PLAYER_WIDTH, PLAYER_HEIGHT)).convert_alpha(),
-    RANNY_SHEET_1.load_strip(pg.Rect(512, 0, 512, 1024), 4))
-)
-
-PLAYER_WALKING_IMAGES_LEFT = [pg.transform.flip(
-    s, 1, 0).convert_alpha() for s in PLAYER_WALKING_IMAGES_RIGHT]
-
-# ranny jumping
-RANNY_SHEET_2 = SpriteSheet(BASE_PATH + "assets/sprites/ranny_spritesheet_2.png")  # noqa
+PLAYER_SIZE = (PLAYER_WIDTH, int(PLAYER_HEIGHT))
+PLAYER_WALKING_FRAMES = 4
+
+
+RANNY_IDLE = "assets/sprites/ranny_silouette.png"
+RANNY_SHEET_1 = "assets/sprites/ranny_spritesheet_1.png"
+RANNY_SHEET_2 = "assets/sprites/ranny_spritesheet_2.png"
+RANNY_WALKING_RECT = (512, 0, 512, 1024)
+RANNY_JUMPING_RECT = (512, 0, 256, 510)
+
+
+@cache
+def player_images():
+    """[state][facing right] -> image (list of frames when walking), loaded on first use."""
+    return [
+        # ranny idle
+        [resources.image(RANNY_IDLE, PLAYER_SIZE, flip=True),
+         resources.image(RANNY_IDLE, PLAYER_SIZE)],
+        # ranny walking
+        [resources.sheet_strip(RANNY_SHEET_1, RANNY_WALKING_RECT, PLAYER_WALKING_FRAMES, PLAYER_SIZE, flip=True),
+         resources.sheet_strip(RANNY_SHEET_1, RANNY_WALKING_RECT, PLAYER_WALKING_FRAMES, PLAYER_SIZE)],
+        # ranny jumping
+        [resources.sheet_strip(RANNY_SHEET_2, RANNY_JUMPING_RECT, 1, PLAYER_SIZE, flip=True)[0],
+         resources.sheet_strip(RANNY_SHEET_2, RANNY_JUMPING_RECT, 1, PLAYER_SIZE)[0]],
+    ]
 
-PLAYER_JUMPING_IMAGE_RIGHT = pg.transform.scale(
-    RANNY_SHEET_2.image_at(pg.Rect(512, 0, 256, 510)), (PLAYER_WIDTH, PLAYER_HEIGHT)).convert_alpha()
-PLAYER_JUMPING_IMAGE_LEFT = pg.transform.flip(
-    PLAYER_JUMPING_IMAGE_RIGHT, 1, 0).convert_alpha()
 
 # ==================
 # Base Classes
@@ -43,12 +53,13 @@ PLAYER_JUMPING_IMAGE_LEFT = pg.transform.flip(
 
 
 class Entity(pg.sprite.Sprite):
-    def __init__(self, x: float, y: float, image: pg.Surface):
+    def __init__(self, x: float, y: float, image: pg.Surface = None, size: tuple[int, int] = (BLOCK_SIZE, BLOCK_SIZE)):
         super().__init__()
-        self.image = image
-        self.rect = image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+        # without an image, the class level (lazy) image is used
+        if image is not None:
+            self.image = image
+            size = image.get_size()
+        self.rect = pg.Rect(x, y, *size)
 
         self.vx = 0.0
         self.vy = 0.0
@@ -56,6 +67,12 @@ class Entity(pg.sprite.Sprite):
     def apply_gravity(self, gravity: float = 1.0, terminal_vel: float = 32.0):
         self.vy = min(self.vy + gravity, terminal_vel)
 
+    def moved(self):
+        """Call after changing rect, keeps the spatial groups this is in up to date."""
+        for group in self.groups():
+            if isinstance(group, SpatialGroup):
+                group.relocate(self)
+
 
 class Block(pg.sprite.Sprite):
     class BlockType(IntEnum):
@@ -67,88 +84,286 @@ class Block(pg.sprite.Sprite):
         def has_value(cls, value):
             return value in cls._value2member_map_
 
-    def __init__(self, x: int, y: int, block_type: int, image: list[pg.Surface]):
+    def __init__(self, x: int, y: int, block_type: int, image: pg.Surface = None):
         super().__init__()
         self.block_type = block_type
-        self.image = image
-        self.rect = image.get_rect()
-        self.rect.x = x
-        self.rect.y = y
+        if image is not None:
+            self.image = image
+        self.rect = pg.Rect(x, y, BLOCK_SIZE, BLOCK_SIZE)
 
 
 class Grassblock(Block):
     block_type = Block.BlockType.GRASS
-    image = load_image(BASE_PATH + "assets/sprites/grass_block.png")
+    image = LazyImage("assets/sprites/grass_block.png")
 
     def __init__(self, x: int, y: int, image: pg.Surface = None):
-        super().__init__(x, y, self.block_type, image or self.image)
+        super().__init__(x, y, self.block_type, image)
 
 
 class Dirtblock(Block):
     block_type = Block.BlockType.DIRT
-    image = load_image(BASE_PATH + "assets/sprites/dirt_block.png")
+    image = LazyImage("assets/sprites/dirt_block.png")
 
     def __init__(self, x: int, y: int, image: pg.Surface = None):
-        super().__init__(x, y, self.block_type, image or self.image)
+        super().__init__(x, y, self.block_type, image)
 
 
 class Lavablock(Block):
     block_type = Block.BlockType.LAVA
-    image = load_image(BASE_PATH + "assets/sprites/lava_block.png")
+    image = LazyImage("assets/sprites/lava_block.png")
 
     def __init__(self, x: int, y: int, image: pg.Surface = None):
-        super().__init__(x, y, self.block_type, image or self.image)
+        super().__init__(x, y, self.block_type, image)
+
+
+BLOCK_CONSTRUCTORS: list[None | type[Block]] = [
+    None,
+    Grassblock,
+    Dirtblock,
+    Lavablock,
+    None,
+    None,
+    None,
+    None,
+    None,
+    None,
+]
 
 
 def BlockFactory(x, y, block_type=Block.BlockType.GRASS, image=None):
-    constructors: list[None | Block] = [
-        None,
-        Grassblock,
-        Dirtblock,
-        Lavablock,
-        None,
-        None,
-        None,
-        None,
-        None,
-        None,
-    ]
-    return constructors[block_type](x, y, image)
+    return BLOCK_CONSTRUCTORS[block_type](x, y, image)
+
+
+def block_image(block_type: int) -> pg.Surface:
+    return BLOCK_CONSTRUCTORS[block_type].image
+
+
+class TileHit(NamedTuple):
+    """A solid tile found by a collision query, quacks like a Block for rect/block_type."""
+    rect: pg.Rect
+    block_type: int
 
 # ==================
 
 
 class Coin(Entity):
-    image = load_image(BASE_PATH + "assets/sprites/coin.png")
+    image = LazyImage("assets/sprites/coin.png")
 
     def __init__(self, x: float, y: float, image: pg.Surface = None):
-        super().__init__(x, y, image or self.image)
+        super().__init__(x, y, image)
         self.val = 1
 
 
 class Endpoint(Entity):
-    image = load_image(BASE_PATH+"assets/sprites/pride.png")
+    image = LazyImage("assets/sprites/pride.png")
 
     def __init__(self, x: int, y: int, image: pg.Surface = None):
-        super().__init__(x, y, image or self.image)
+        super().__init__(x, y, image)
+
+
+def sprite_spec() -> list[tuple[str, tuple]]:
+    """(resources loader, args) for every sprite the game draws, this is what atlas.py packs."""
+    spec = []
+    for flip in (True, False):
+        spec += [
+            ("image", (RANNY_IDLE, PLAYER_SIZE, flip)),
+            ("sheet_strip", (RANNY_SHEET_1, RANNY_WALKING_RECT,
+             PLAYER_WALKING_FRAMES, PLAYER_SIZE, flip)),
+            ("sheet_strip", (RANNY_SHEET_2, RANNY_JUMPING_RECT, 1, PLAYER_SIZE, flip)),
+        ]
+    for cls in (Grassblock, Dirtblock, Lavablock, Coin, Endpoint):
+        lazy = cls.__dict__["image"]
+        spec.append(("image", (lazy.path, lazy.size, False)))
+    return spec
 
 
 # ==================
 # Level
 # ==================
 
+# compiled tile values: 0 is empty, 1-9 are block types, then the entities
+TILE_EMPTY = 0
+TILE_COIN = 10
+TILE_ENDPOINT = 11
+TILE_INVALID = 255
+
+
+def make_tile_table() -> bytes:
+    # block string character -> tile value, anything unknown -> TILE_INVALID
+    table = bytearray([TILE_INVALID]) * 256
+    table[ord("0")] = TILE_EMPTY
+    for block_type in Block.BlockType:
+        table[ord(str(int(block_type)))] = block_type
+    table[ord("C")] = TILE_COIN
+    table[ord("F")] = TILE_ENDPOINT
+    return bytes(table)
+
+
+TILE_TABLE = make_tile_table()
+
+SPRITE_BYTES = 512  # rough size of a sprite + rect + group entries, for cache budgeting
+
+
+def changed_cells(old: bytes, new: bytes, block: int = 256) -> list[int]:
+    """Indices where `old` and `new` (same length) differ, a block at a time so unchanged runs are cheap."""
+    changed = []
+    for start in range(0, len(new), block):
+        end = min(start + block, len(new))
+        if old[start:end] != new[start:end]:
+            changed.extend(i for i in range(start, end) if old[i] != new[i])
+    return changed
+
+
+class LevelError(Exception):
+    """A level file that can't be played, raised when it is compiled."""
+
+
 class Level:
+    # bump whenever compile or check change what they produce or accept,
+    # so levels compiled by an older version are not served from the cache
+    COMPILER_VERSION = 1
+
     @staticmethod
-    def from_file(path: str):
-        with open(path, 'r') as f:
-            level_data = yaml.load(f, yaml.Loader)
-            return Level(level_data)
+    def from_file(path: str, use_cache=True):
+        from . import streaming
+        if path.endswith(streaming.STREAM_EXT):
+            # too big to load, paged in around the player instead
+            return streaming.StreamingLevel(path)
+        if use_cache:
+            data, tiles = levelcache.load(
+                path, Level.compile, Level.COMPILER_VERSION)
+        else:
+            data, tiles = levelcache.compile_file(
+                path, Level.compile, write_cache=False,
+                compiler_version=Level.COMPILER_VERSION)
+        level = Level(data, tiles)
+        level.path = path
+        return level
 
-    def __init__(self, data: dict):
+    @staticmethod
+    def compile(data: dict) -> tuple[dict, bytes]:
+        """Splits parsed level yaml into (everything but the block string, one tile value per cell)."""
+        level_data = data.get("data", {}) if isinstance(data, dict) else None
+        if not isinstance(level_data, dict) or not all(
+                isinstance(level_data.get(key, {}), dict) for key in ("player", "world")):
+            raise LevelError(
+                "a level needs to be a mapping with data.player and data.world settings")
+        data = {**data, "data": {**data.get("data", {})}}
+        world_args = data["data"]["world"] = {
+            **data["data"].get("world", {})}
+        block_str = world_args.pop("blocks", None)
+        Level.check(data)
+        return data, Level.compile_blocks(block_str, world_args.get("rows"), world_args.get("cols"), data.get("name"))
+
+    @staticmethod
+    def check(data: dict):
+        """Raises LevelError if the settings (everything but the blocks) would break the game."""
+        name = data.get("name")
+        level_data = data.get("data", {})
+        player_args = level_data.get("player", {})
+        world_args = level_data.get("world", {})
+
+        for key in ("speed", "jump-power", "lives"):
+            if not isinstance(player_args.get(key), (int, float)):
+                raise LevelError(
+                    f"player {key} in level {name} needs to be a number")
+        for key in ("starting-pos", "respawn-pos"):
+            pos = player_args.get(key, (0, 0))
+            if not isinstance(pos, (list, tuple)) or len(pos) != 2:
+                raise LevelError(
+                    f"player {key} in level {name} needs to be [x, y]")
+
+        for key in ("rows", "cols"):
+            value = world_args.get(key)
+            if not isinstance(value, int) or value <= 0:
+                raise LevelError(
+                    f"world {key} in level {name} needs to be a positive integer")
+        if (background_image := world_args.get("background-image")):
+            path = background_image if os.path.isabs(
+                background_image) else BASE_PATH + background_image
+            if not os.path.exists(path):
+                raise LevelError(
+                    f"background image {background_image} of level {name} does not exist")
+
+    @staticmethod
+    def compile_blocks(block_str: str, rows: int, cols: int, name: str = None) -> bytes:
+        # check block_str is string
+        if not isinstance(block_str, str):
+            raise LevelError(
+                f"block string of level {name} needs to be an instance of string")
+
+        block_str = block_str.replace("\n", "")
+
+        # check length of block_str is correct
+        if len(block_str) != rows * cols:
+            raise LevelError(
+                f"length of block string {len(block_str)} in level {name} does not match "
+                f"given row {rows} and col {cols} attributes")
+
+        # non-ascii characters become "?", which is invalid like any other unknown value
+        tiles = block_str.encode("ascii", "replace").translate(TILE_TABLE)
+
+        if (idx := tiles.find(TILE_INVALID)) >= 0:
+            # invalid value
+            x, y = idx % cols, idx // cols
+            raise LevelError(
+                f"value “{block_str[idx]}” in level {name} on cell ({x}, {y}) is invalid")
+        return tiles
+
+    def __init__(self, data: dict, tiles: bytes = None):
         self.completed = False
+        self.path = None  # the file it came from, if any (see Game.reload_level)
+        self.configure(data)
+        self.total_coins = 0
 
-        self.name = data.get("name")
+        # define layers
+        self.starting_coins = []
+        self.starting_endpoints = []
+
+        # spatially hashed so pickups and render culling only look nearby
+        self.coins = SpatialGroup()
+        self.endpoints = SpatialGroup()
+
+        self.active_sprites = SpatialGroup()
+
+        # the world itself is one byte per cell (row-major), see TILE_*.
+        # blocks only become sprites if something asks for `blocks`
+        if tiles is None:
+            world_args = data.get("data", {}).get("world", {})
+            tiles = Level.compile_blocks(
+                world_args.get("blocks"), self.rows, self.cols, self.name)
+        self.tiles = bytearray(tiles)
+
+        for match in re.finditer(rb"[\x0a\x0b]", self.tiles):
+            idx = match.start()
+            x, y = idx % self.cols, idx // self.cols
+            block_x, block_y = x * BLOCK_SIZE, y * BLOCK_SIZE
+
+            if self.tiles[idx] == TILE_COIN:
+                # coin
+                self.starting_coins.append(
+                    Coin(block_x, block_y))
+                self.total_coins += 1
+            else:
+                # endpoint
+                self.starting_endpoints.append(
+                    Endpoint(block_x, block_y)
+                )
+
+        self.coins.add(self.starting_coins)
+        self.endpoints.add(self.starting_endpoints)
+
+        self.active_sprites.add(self.coins, self.starting_endpoints)
 
+        # background + blocks, baked lazily in column chunks around the camera
+        self.static_layer = ChunkedLayer(self)
+
+    def configure(self, data: dict):
+        """Everything but the world itself: name, player and world settings."""
+        self.data = data
+        self.__dict__.pop("content_hash", None)
+        self.name = data.get("name")
+        self.version = data.get("version")
         level_data = data.get("data", {})
         # player
         player_args = level_data.get("player", {})
@@ -173,88 +388,171 @@ class Level:
         self.gravity = world_args.get("gravity", 1.0)
         self.terminal_velocity = world_args.get("terminal-velocity", 32.0)
 
+        self.background_image = None
         if (background_image := world_args.get("background-image")):
-            self.background_image = pg.image.load(
-                background_image).convert_alpha()
+            self.background_image = resources.image(background_image)
         self.background_color = world_args.get("background-color")
-        self.total_coins = 0
-
-        # define layers
-        self.starting_blocks = []
-        self.starting_coins = []
-        self.starting_endpoints = []
 
-        self.blocks = pg.sprite.Group()
-        self.coins = pg.sprite.Group()
-        self.endpoints = pg.sprite.Group()
-
-        self.active_sprites = pg.sprite.Group()
-        self.static_sprites = pg.sprite.Group()
-
-        block_str = world_args.get("blocks")
-
-        # check block_str is string
-        assert isinstance(block_str, str), \
-            "block string needs to be an instance of string"
-
-        block_str = block_str.replace("\n", "")
-
-        # check length of block_str is correct
-        assert len(block_str) == self.rows * self.cols, \
-            f"length of block string {len(block_str)} does not match given \
-            row {self.rows} and col {self.cols} attributes"
+    def follow(self, rect: pg.Rect):
+        """Called as the player moves, a StreamingLevel pages chunks in and out here."""
+        pass
 
+    def tile_at(self, x: int, y: int) -> int:
+        if 0 <= x < self.cols and 0 <= y < self.rows:
+            return self.tiles[y * self.cols + x]
+        return TILE_EMPTY
+
+    def blocks_in_rect(self, rect: pg.Rect) -> list[TileHit]:
+        """Solid tiles overlapping `rect`, in the same (row-major) order spritecollide would return them."""
+        if rect.width <= 0 or rect.height <= 0:
+            return []
+        left = max(rect.left // BLOCK_SIZE, 0)
+        right = min((rect.right - 1) // BLOCK_SIZE, self.cols - 1)
+        top = max(rect.top // BLOCK_SIZE, 0)
+        bottom = min((rect.bottom - 1) // BLOCK_SIZE, self.rows - 1)
+
+        tiles, cols = self.tiles, self.cols
+        hits = []
+        for y in range(top, bottom + 1):
+            row = y * cols
+            for x in range(left, right + 1):
+                tile = tiles[row + x]
+                if TILE_EMPTY < tile < TILE_COIN:
+                    hits.append(TileHit(pg.Rect(x * BLOCK_SIZE, y * BLOCK_SIZE,
+                                                BLOCK_SIZE, BLOCK_SIZE), tile))
+        return hits
+
+    def block_blits(self, first_col: int, last_col: int) -> list[tuple[pg.Surface, tuple[int, int]]]:
+        """(image, level position) for every block in columns [first_col, last_col)."""
+        tiles, cols = self.tiles, self.cols
+        blits = []
         for y in range(self.rows):
-            for x in range(self.cols):
-                idx = y * self.cols + x
-                cell = block_str[idx]
-                block_x, block_y = x * BLOCK_SIZE, y * BLOCK_SIZE
-
-                if cell == "0":
-                    # empty
-                    continue
-                elif cell.isdigit() and Block.BlockType.has_value((block_type := int(cell))):
-                    # block
-                    self.starting_blocks.append(
-                        BlockFactory(block_x, block_y, block_type))
-                elif cell == "C":
-                    # coin
-                    self.starting_coins.append(
-                        Coin(block_x, block_y))
-                    self.total_coins += 1
-                elif cell == "F":
-                    # endpoint
-                    self.starting_endpoints.append(
-                        Endpoint(block_x, block_y)
-                    )
-                else:
-                    # invalid value
-                    raise Exception(
-                        f"value “{cell}” in level {self.name} on cell ({x}, {y}) is invalid")
+            row = y * cols
+            for x in range(first_col, last_col):
+                tile = tiles[row + x]
+                if TILE_EMPTY < tile < TILE_COIN:
+                    blits.append((block_image(tile),
+                                  (x * BLOCK_SIZE, y * BLOCK_SIZE)))
+        return blits
+
+    def apply_tiles(self, tiles: bytes) -> list[tuple[int, int]]:
+        """
+        Patches the world to `tiles` (same size) in place and returns the
+        (col, row) of every cell that changed. Coins that are still there keep
+        whether they were collected, new ones start uncollected.
+        """
+        changed = changed_cells(self.tiles, tiles)
+        entities = False
+        for idx in changed:
+            entities |= self.tiles[idx] >= TILE_COIN or tiles[idx] >= TILE_COIN
+            self.tiles[idx] = tiles[idx]
+        if entities:
+            self.rebuild_entities()
+        if changed:
+            for name in ("starting_blocks", "blocks", "static_sprites", "content_hash"):
+                self.__dict__.pop(name, None)
+        return [(idx % self.cols, idx // self.cols) for idx in changed]
+
+    def rebuild_entities(self):
+        # sprites of coins/endpoints that did not move are reused
+        old = {(sprite.rect.x, sprite.rect.y): sprite
+               for sprite in self.starting_coins + self.starting_endpoints}
+        coins, endpoints = [], []
+        for match in re.finditer(rb"[\x0a\x0b]", self.tiles):
+            idx = match.start()
+            pos = idx % self.cols * BLOCK_SIZE, idx // self.cols * BLOCK_SIZE
+            if self.tiles[idx] == TILE_COIN:
+                sprite = old.get(pos)
+                coins.append(sprite if isinstance(sprite, Coin) else Coin(*pos))
+            else:
+                sprite = old.get(pos)
+                endpoints.append(sprite if isinstance(
+                    sprite, Endpoint) else Endpoint(*pos))
+
+        existing = set(self.starting_coins)
+        live = [coin for coin in coins
+                if coin.alive() or coin not in existing]
+        others = [sprite for sprite in self.active_sprites
+                  if not isinstance(sprite, (Coin, Endpoint))]
+        self.starting_coins = coins
+        self.starting_endpoints = endpoints
+        self.total_coins = len(coins)
+
+        self.coins.empty()
+        self.coins.add(live)
+        self.endpoints.empty()
+        self.endpoints.add(endpoints)
+        self.active_sprites.empty()
+        self.active_sprites.add(live, endpoints, others)
+
+    def tile_grid(self) -> bytes:
+        """Every tile row-major (see the TILE_ constants), for tools that want the whole world at once."""
+        return bytes(self.tiles)
+
+    def tile_cells(self, tile: int) -> list[tuple[int, int]]:
+        """(row, col) of every `tile`, row-major, which is also the order coins are numbered in."""
+        cols = self.cols
+        return [divmod(match.start(), cols)
+                for match in re.finditer(re.escape(bytes([tile])), self.tile_grid())]
+
+    @cached_property
+    def content_hash(self) -> str:
+        """sha1 of the compiled level (settings and tiles), changes whenever the level is edited."""
+        digest = hashlib.sha1(json.dumps(self.data, sort_keys=True, default=str).encode())
+        digest.update(self.tiles)
+        return digest.hexdigest()
+
+    # sprites for the blocks, only built for code that still wants them
+
+    @cached_property
+    def starting_blocks(self) -> list[Block]:
+        cols = self.cols
+        return [BlockFactory(idx % cols * BLOCK_SIZE, idx // cols * BLOCK_SIZE, tile)
+                for idx, tile in enumerate(self.tiles)
+                if TILE_EMPTY < tile < TILE_COIN]
+
+    @cached_property
+    def blocks(self) -> pg.sprite.Group:
+        return pg.sprite.Group(self.starting_blocks)
+
+    @cached_property
+    def static_sprites(self) -> pg.sprite.Group:
+        return pg.sprite.Group(self.blocks)
+
+    def memory_estimate(self) -> int:
+        sprites = len(self.starting_coins) + len(self.starting_endpoints)
+        if "starting_blocks" in self.__dict__:
+            sprites += len(self.starting_blocks)
+        return self.static_layer.memory() + len(self.tiles) + sprites * SPRITE_BYTES
+
+    def reset(self):
+        self.completed = False
 
-        self.blocks.add(self.starting_blocks)
+        self.coins.empty()
         self.coins.add(self.starting_coins)
-        self.endpoints.add(self.starting_endpoints)
 
+        # drops any previous player too
+        self.active_sprites.empty()
         self.active_sprites.add(self.coins, self.starting_endpoints)
-        self.static_sprites.add(self.blocks)
-
-        # is this a good idea?
-        self.background_layer = pg.Surface(self.size, pg.SRCALPHA, COLOR_DEPTH)
-        self.blocks_layer = pg.Surface(self.size, pg.SRCALPHA, COLOR_DEPTH)
-        self.active_layer = pg.Surface(self.size, pg.SRCALPHA, COLOR_DEPTH)
-
-        if self.background_color:
-            self.background_layer.fill(pg.Color(*self.background_color))
 
-        if hasattr(self, "background_image"):
-            pg.transform.scale(self.background_image, SCREEN_SIZE)
-            self.background_image.blit(self.background_layer, (0, 0))
-
-        self.static_sprites.draw(self.blocks_layer)
-
-    def reset(self):
-        pass
+    def coin_mask(self) -> int:
+        """Bit i is set while starting_coins[i] has not been collected."""
+        mask = 0
+        for i, coin in enumerate(self.starting_coins):
+            if coin.alive():
+                mask |= 1 << i
+        return mask
+
+    def restore_coins(self, mask: int):
+        coins = [coin for i, coin in enumerate(self.starting_coins)
+                 if mask >> i & 1]
+        self.coins.empty()
+        self.coins.add(coins)
+        # keep the draw order of a fresh level: coins, endpoints, then the rest
+        others = [sprite for sprite in self.active_sprites
+                  if not isinstance(sprite, (Coin, Endpoint))]
+        self.active_sprites.empty()
+        self.active_sprites.add(coins, self.starting_endpoints, others)
 
 
 # ==================
@@ -267,35 +565,42 @@ class Player(Entity):
         JUMPING = 2
 
     image_interval = 10  # update anim every x frames
-    images = [
-        [PLAYER_IDLE_IMAGE_LEFT, PLAYER_IDLE_IMAGE_RIGHT],
-        [PLAYER_WALKING_IMAGES_LEFT, PLAYER_WALKING_IMAGES_RIGHT],
-        [PLAYER_JUMPING_IMAGE_LEFT, PLAYER_JUMPING_IMAGE_RIGHT],
-    ]
 
     def __init__(self, game: 'Game'):
         self.game = game
         self.level = game.level
         x, y = self.level.player_starting_pos
-        super().__init__(x, y, PLAYER_IDLE_IMAGE_RIGHT)
+        super().__init__(x, y, size=PLAYER_SIZE)
 
-        self.coins_collected = 0
-        self.lives = self.level.player_lives
         self.speed = self.level.player_speed
         self.jump_power = self.level.player_jump_power
+        self.respawn()
+
+    def respawn(self):
+        """Back to the state of a fresh level: start position, full lives, no coins."""
+        self.rect.topleft = self.level.player_starting_pos
+        self.vx = 0.0
+        self.vy = 0.0
+
+        self.coins_collected = 0
+        self.lives = self.level.player_lives
 
         self.grounded = False
         self.facing_right = True
         self.state = Player.State.IDLE
         self.anim_steps = 0
         self.image_index = 0
+        # (state, facing right, frame), the image itself is only looked up when drawn
+        self.image_key = (Player.State.IDLE, 1, 0)
 
         self.level.active_sprites.add(self)
+        self.moved()
 
     def tick(self):
         self.apply_gravity(self.level.gravity,
                            self.level.terminal_velocity)
         self.move_and_process_blocks()
+        self.level.follow(self.rect)
         self.process_coins()
         self.process_endpoints()
         self.check_world_boundaries()
@@ -304,14 +609,22 @@ class Player(Entity):
         if self.anim_steps == 0:
             self.update_image()
         self.anim_steps = (self.anim_steps + 1) % self.image_interval
+        self.moved()
+
+    @property
+    def image(self) -> pg.Surface:
+        state, facing, frame = self.image_key
+        if state == Player.State.WALKING:
+            return player_images()[state][facing][frame]
+        return player_images()[state][facing]
 
     def update_image(self):
+        facing = 1 if self.facing_right else 0
         if self.state == Player.State.WALKING:
-            images = Player.images[Player.State.WALKING][1 if self.facing_right else 0]
-            self.image = images[self.image_index]
-            self.image_index = (self.image_index + 1) % len(images)
+            self.image_key = (self.state, facing, self.image_index)
+            self.image_index = (self.image_index + 1) % PLAYER_WALKING_FRAMES
         else:
-            self.image = Player.images[self.state][1 if self.facing_right else 0]
+            self.image_key = (self.state, facing, 0)
 
     def update_state(self):
         new_state = None
@@ -350,10 +663,9 @@ class Player(Entity):
         self.vy = -self.jump_power
 
     def move_and_process_blocks(self):
-        blocks = self.level.blocks
+        level = self.level
         self.rect.x += self.vx
-        collide_list = pg.sprite.spritecollide(
-            self, blocks, False)
+        collide_list = level.blocks_in_rect(self.rect)
 
         for block in collide_list:
             if self.vx > 0:
@@ -363,8 +675,7 @@ class Player(Entity):
 
         self.grounded = False
         self.rect.y += self.vy
-        collide_list = pg.sprite.spritecollide(
-            self, blocks, False)
+        collide_list = level.blocks_in_rect(self.rect)
 
         for block in collide_list:
             # special actions
@@ -386,18 +697,14 @@ class Player(Entity):
     def win(self):
         self.game.flags |= Game.Flags.WIN
 
-    def respawn(self):
-        pass
-
     def process_coins(self):
-        collide_list = pg.sprite.spritecollide(self, self.level.coins, False)
+        collide_list = self.level.coins.collide(self)
         for coin in collide_list:
             coin.kill()
             self.coins_collected += 1
 
     def process_endpoints(self):
-        collide_list = pg.sprite.spritecollide(
-            self, self.level.endpoints, False)
+        collide_list = self.level.endpoints.collide(self)
         if len(collide_list) > 0:
             self.win()
 
@@ -406,18 +713,55 @@ class Player(Entity):
         # ==================
 
 
+SCORE_CACHE_SIZE = 32
+MAX_INTERPOLATION = BLOCK_SIZE  # px per tick, anything further is a teleport
+
+# finished score surfaces by (coins, total coins), shared like widgets.text_cache
+score_cache = LRUCache(SCORE_CACHE_SIZE)
+
+
+class GameState(NamedTuple):
+    """Everything that changes while playing a level, see `Game.snapshot`."""
+    level: int
+    flags: int
+    x: int
+    y: int
+    vx: float
+    vy: float
+    state: int
+    facing_right: bool
+    grounded: bool
+    lives: int
+    coins_collected: int
+    coins: int  # bitset of remaining coins, see Level.coin_mask
+    anim_steps: int
+    image_index: int
+    image_key: tuple[int, int, int]
+
+
 class Game:
     class Flags(IntEnum):
         WIN = 1
 
-    def __init__(self):
+    def __init__(self, dirty_rendering=False, prefetch=True):
         self.game_over = False
         self.flags = 0
 
+        # constructed levels, the next one is built in the background while playing
+        self.levels = levelcache.LevelCache(Level.from_file, prefetch=prefetch)
+
+        # only redraw (and push to the display) what changed since last frame
+        self.dirty_rendering = dirty_rendering
+        self.drawn: dict | None = None  # what each sprite/hud item looked like last frame
+        self.drawn_offset = None
+        self.invalid_rects: list[pg.Rect] = []  # drawn over from outside, redraw next frame
+        self.prev_pos = None  # player position before the last tick, for interpolation
+
     def start(self):
         pass
 
     def tick(self):
+        self.prev_pos = self.player.rect.topleft
         self.player.tick()
 
     def process_keypresses(self, keys: list[bool]):
@@ -436,74 +780,259 @@ class Game:
             if self.player.state != Player.State.JUMPING:
                 self.player.stop()
 
-    def calculate_offset(self):
-        x = -self.player.rect.centerx + SCREEN_WIDTH / 2
+    def calculate_offset(self, player_rect: pg.Rect = None):
+        centerx = (player_rect or self.player.rect).centerx
+        x = -centerx + SCREEN_WIDTH / 2
 
-        if self.player.rect.centerx < SCREEN_WIDTH / 2:
+        if centerx < SCREEN_WIDTH / 2:
             x = 0
-        elif self.player.rect.centerx > self.level.width - SCREEN_WIDTH / 2:
+        elif centerx > self.level.width - SCREEN_WIDTH / 2:
             x = -self.level.width + SCREEN_WIDTH
 
         return x, 0
 
-    def render(self, surf: pg.Surface):
-        self.level.active_layer.fill(TRANSPARENT)
-        self.level.active_sprites.draw(self.level.active_layer)
+    def interpolated_rect(self, alpha: float) -> pg.Rect:
+        """Where to draw the player `alpha` of the way from the previous tick to the last one."""
+        rect = self.player.rect
+        if alpha >= 1.0 or self.prev_pos is None:
+            return rect
+        dx, dy = rect.x - self.prev_pos[0], rect.y - self.prev_pos[1]
+        if abs(dx) > MAX_INTERPOLATION or abs(dy) > MAX_INTERPOLATION:
+            return rect  # respawned or restored, don't slide across the level
+        return rect.move(round(dx * (alpha - 1.0)), round(dy * (alpha - 1.0)))
+
+    def viewport(self, offset: tuple[float, float]) -> pg.Rect:
+        return pg.Rect(-offset[0], -offset[1], SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    def render(self, surf: pg.Surface, alpha: float = 1.0) -> list[pg.Rect]:
+        """
+        Draws the frame and returns the screen rects that need to be pushed to
+        the display. With `alpha` < 1 the player (and camera) are drawn between
+        the previous tick and the last one, see App.run_loop.
+        """
+        self.update_hud()
+        player_rect = self.interpolated_rect(alpha)
+        offset = self.calculate_offset(player_rect)
+        viewport = self.viewport(offset)
+        ox, oy = offset
+
+        static = self.level.static_layer.blits(viewport, offset)
+        drawn = {}
+        # the interpolated player can be a little off its rect
+        near = viewport.inflate(2 * MAX_INTERPOLATION, 2 * MAX_INTERPOLATION)
+        for sprite in self.level.active_sprites.near(near):
+            rect = player_rect if sprite is self.player else sprite.rect
+            if rect.colliderect(viewport):
+                drawn[sprite] = (sprite.image, rect.move(ox, oy))
+        for key, item in self.hud_items():
+            drawn[key] = item
+
+        if not self.dirty_rendering or self.drawn is None or offset != self.drawn_offset:
+            # camera moved (or first frame), everything is dirty
+            self.draw_region(surf, None, static, list(drawn.values()))
+            dirty = [surf.get_rect()]
+        else:
+            dirty = self.changed_rects(self.drawn, drawn) + self.invalid_rects
+            items = list(drawn.values())
+            for rect in dirty:
+                self.draw_region(surf, rect, static, items)
+            surf.set_clip(None)
+
+        self.drawn = drawn if self.dirty_rendering else None
+        self.drawn_offset = offset
+        self.invalid_rects.clear()
+        return dirty
+
+    def invalidate(self, rect: pg.Rect):
+        """Marks a screen area that someone else drew over, so the next dirty render repaints it."""
+        self.invalid_rects.append(pg.Rect(rect))
+
+    @staticmethod
+    def draw_region(surf: pg.Surface, clip: pg.Rect | None, static: list, items):
+        surf.set_clip(clip)
+        surf.blits(static, doreturn=False)
+        if clip is None:
+            surf.blits(items, doreturn=False)
+        else:
+            surf.blits([item for item in items if clip.colliderect(item[1])],
+                       doreturn=False)
 
-        blit_coords = self.calculate_offset()
-        surf.blits([
-            (self.level.background_layer, blit_coords),
-            (self.level.blocks_layer, blit_coords),
-            (self.level.active_layer, blit_coords)
-        ])
-        self.show_level_text(surf)
-        self.show_score(surf)
-        self.show_win_text(surf)
+    @staticmethod
+    def changed_rects(prev: dict, curr: dict) -> list[pg.Rect]:
+        rects = []
+        for key, item in curr.items():
+            old = prev.get(key)
+            if old is None:
+                rects.append(item[1])
+            elif old[0] is not item[0] or old[1] != item[1]:
+                # moved or changed image: old and new area, merged if they overlap
+                if old[1].colliderect(item[1]):
+                    rects.append(old[1].union(item[1]))
+                else:
+                    rects.extend((old[1], item[1]))
+        for key, item in prev.items():
+            if key not in curr:
+                # collected coin, sprite scrolled away, hud item gone
+                rects.append(item[1])
+        return rects
 
     def reset(self):
         self.flags = 0
         self.start()
-        self.load_level(self.curr_level)
+        self.level.reset()
+        self.player.respawn()
+        self.drawn = None
+        self.prev_pos = None
+
+    def snapshot(self) -> GameState:
+        p = self.player
+        state, facing, frame = p.image_key
+        return GameState(self.curr_level, int(self.flags), p.rect.x, p.rect.y, p.vx, p.vy, int(p.state), p.facing_right,
+                         p.grounded, p.lives, p.coins_collected, self.level.coin_mask(),
+                         p.anim_steps, p.image_index, (int(state), facing, frame))
+
+    def restore(self, state: GameState):
+        """Puts the current level back to `state`, which must come from the same level."""
+        if state.level != self.curr_level:
+            raise ValueError(
+                f"snapshot is from level {state.level}, current level is {self.curr_level}")
+
+        self.flags = state.flags
+        p = self.player
+        p.rect.topleft = state.x, state.y
+        p.vx, p.vy = state.vx, state.vy
+        p.state = Player.State(state.state)
+        p.facing_right = state.facing_right
+        p.grounded = state.grounded
+        p.lives = state.lives
+        p.coins_collected = state.coins_collected
+        p.anim_steps = state.anim_steps
+        p.image_index = state.image_index
+        p.image_key = state.image_key
+        p.moved()
+        self.level.restore_coins(state.coins)
+        self.prev_pos = None
 
     def load_level(self, level_index: int):
         try:
-            self.level = Level.from_file(LEVELS[level_index])
-            self.player = Player(self)
-            self.curr_level = level_index
-            return 0
+            level = self.levels.get(LEVELS[level_index])
         except IndexError:
             return -1
 
+        self.set_level(level, level_index)
+
+        if level_index + 1 < len(LEVELS):
+            self.levels.prefetch(LEVELS[level_index + 1])
+        return 0
+
+    def reload_level(self) -> list[tuple[int, int]] | None:
+        """
+        Re-reads the file of the current level and patches it in place: the
+        settings, the changed tiles, coins and endpoints, and only those cells
+        of the baked layer. The player stays where it is. A level that changed
+        size is rebuilt instead (and None returned).
+        """
+        level, player = self.level, self.player
+        data, tiles = levelcache.load(
+            level.path, Level.compile, Level.COMPILER_VERSION)
+        world_args = data["data"]["world"]
+
+        if (world_args["rows"], world_args["cols"]) != (level.rows, level.cols):
+            fresh = Level(data, tiles)
+            fresh.path = level.path
+            pos = player.rect.topleft
+            self.levels.put(level.path, fresh)
+            self.set_level(fresh, self.curr_level)
+            self.player.rect.topleft = pos
+            self.player.moved()
+            return None
+
+        background = (level.background_color, level.background_image)
+        level.configure(data)
+        player.speed = level.player_speed
+        player.jump_power = level.player_jump_power
+
+        cells = level.apply_tiles(tiles)
+        if (level.background_color, level.background_image) != background:
+            level.static_layer.clear()
+        else:
+            level.static_layer.redraw(cells)
+        self.drawn = None
+        self.prev_level = None  # the name may have changed
+        return cells
+
+    def set_level(self, level: Level, level_index: int = -1):
+        """Starts playing `level`, which does not have to come from LEVELS."""
+        level.reset()
+        self.level = level
+        self.player = Player(self)
+        self.curr_level = level_index
+        self.drawn = None
+        self.prev_pos = None
+
     # the methods below need to be moved out of here (too lazy)
-    def show_level_text(self, surf: pg.Surface):
-        if not hasattr(self, "prev_level") or self.prev_level != self.curr_level:
+    def update_hud(self):
+        self.update_level_text()
+        self.update_score()
+        self.update_win_text()
+
+    def hud_items(self) -> list[tuple[str, tuple[pg.Surface, pg.Rect]]]:
+        items = [
+            ("level_text", (self.level_text.image, self.level_text.rect)),
+            ("score", (self.score_surf, self.r)),
+        ]
+        if self.win_text is not None:
+            items.append(
+                ("win_text", (self.win_text.image, self.win_text.rect)))
+        return items
+
+    def update_level_text(self):
+        if not hasattr(self, "prev_level") or self.prev_level != (self.curr_level, self.level):
             self.level_text = Text(
-                f"{self.curr_level+1}. {self.level.name}", FONT_SM)
+                f"{self.curr_level+1}. {self.level.name}", resources.font(FONT_SM))
             self.level_text.rect.x = 15
             self.level_text.rect.y = 15
+            self.prev_level = (self.curr_level, self.level)
+
+    def update_win_text(self):
+        if not self.flags & Game.Flags.WIN:
+            self.win_text = None
+        elif getattr(self, "win_text", None) is None:
+            self.win_text = Text(END_GAME_TEXT, resources.font(FONT_LG))
+            self.win_text.rect.center = SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2
+
+    def update_score(self):
+        score = (self.player.coins_collected, self.level.total_coins)
+        if not hasattr(self, "prev_score") or self.prev_score != score:
+            self.score_surf = score_cache.get(
+                score, lambda: Game.render_score(*score))
+            self.r = self.score_surf.get_rect(right=SCREEN_WIDTH-15, top=0)
+            self.prev_score = score
+
+    @staticmethod
+    def render_score(coins: int, total_coins: int) -> pg.Surface:
+        image = Coin.image
+        image_rect = image.get_rect(x=0, y=-10)
+
+        text = Text(f"{coins}/{total_coins}", resources.font(FONT_MD))
+        text.rect.left = image_rect.right
+        text.rect.y = 15
+        surf = pg.Surface(
+            (image_rect.width+text.rect.width, max(image_rect.height, text.rect.height)), pg.SRCALPHA, COLOR_DEPTH)
+
+        surf.blit(image, image_rect)
+        text.draw(surf)
+        return surf
+
+    def show_level_text(self, surf: pg.Surface):
+        self.update_level_text()
         self.level_text.draw(surf)
-        self.prev_level = self.curr_level
 
     def show_win_text(self, surf: pg.Surface):
-        if self.flags & Game.Flags.WIN:
-            text = Text(END_GAME_TEXT, FONT_LG)
-            text.rect.center = SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2
-            text.draw(surf)
+        self.update_win_text()
+        if self.win_text is not None:
+            self.win_text.draw(surf)
 
     def show_score(self, surf: pg.Surface):
-        if not hasattr(self, "prev_score") or self.prev_score != self.player.coins_collected:
-            image = Coin.image.copy()
-            image_rect = image.get_rect(x=0, y=-10)
-
-            text = Text(f"{self.player.coins_collected}/{self.level.total_coins}",
-                        FONT_MD)
-            text.rect.left = image_rect.right
-            text.rect.y = 15
-            self.score_surf = pg.Surface(
-                (image_rect.width+text.rect.width, max(image_rect.height, text.rect.height)), pg.SRCALPHA, COLOR_DEPTH)
-            self.r = self.score_surf.get_rect(right=SCREEN_WIDTH-15, top=0)
-
-            self.score_surf.blit(image, image_rect)
-            text.draw(self.score_surf)
+        self.update_score()
         surf.blit(self.score_surf, self.r)
-        self.prev_score = self.player.coins_collected
@@ -0,0 +1,179 @@
+import argparse
+import time
+from enum import IntFlag
+from typing import Callable, Iterable
+
+import pygame as pg
+
+from . import *
+from .game import Game
+
+# runs the simulation without a window or a clock so automated
+# playthroughs go as fast as the cpu allows
+#
+#   python -m ranny_parkour.headless --level 0 --script "R*40,JR*20,R*200"
+
+
+class Keys(IntFlag):
+    NONE = 0
+    JUMP = 1
+    LEFT = 2
+    RIGHT = 4
+
+
+SCRIPT_KEYS = {
+    "J": Keys.JUMP,
+    "L": Keys.LEFT,
+    "R": Keys.RIGHT,
+}
+
+
+class ScriptedKeys:
+    """Stands in for `pg.key.get_pressed()` so `Game.process_keypresses` can read a mask."""
+
+    def __init__(self, mask: int = 0):
+        self.mask = mask
+
+    def __getitem__(self, key: int) -> bool:
+        if key == pg.K_w or key == pg.K_UP:
+            return bool(self.mask & Keys.JUMP)
+        if key == pg.K_a or key == pg.K_LEFT:
+            return bool(self.mask & Keys.LEFT)
+        if key == pg.K_d or key == pg.K_RIGHT:
+            return bool(self.mask & Keys.RIGHT)
+        return False
+
+
+def keys_to_mask(keys) -> int:
+    """The mask for whatever `pg.key.get_pressed()` (or a ScriptedKeys) reports."""
+    mask = Keys.NONE
+    if keys[pg.K_w] or keys[pg.K_UP]:
+        mask |= Keys.JUMP
+    if keys[pg.K_a] or keys[pg.K_LEFT]:
+        mask |= Keys.LEFT
+    if keys[pg.K_d] or keys[pg.K_RIGHT]:
+        mask |= Keys.RIGHT
+    return int(mask)
+
+
+def parse_script(script: str) -> list[int]:
+    """Parses "R*40,JR*20,-*5" into a list of per-tick key masks ("-" = no keys)."""
+    masks = []
+    for token in filter(None, (t.strip() for t in script.split(","))):
+        keys, _, count = token.partition("*")
+        mask = Keys.NONE
+        for k in keys.upper():
+            if k == "-":
+                continue
+            if k not in SCRIPT_KEYS:
+                raise ValueError(f"unknown key “{k}” in script token “{token}”")
+            mask |= SCRIPT_KEYS[k]
+        try:
+            count = int(count or 1)
+        except ValueError:
+            raise ValueError(f"tick count in script token “{token}” is not a number") from None
+        if count < 1:
+            raise ValueError(f"tick count in script token “{token}” must be at least 1")
+        masks.extend([int(mask)] * count)
+    return masks
+
+
+def format_script(masks: Iterable[int]) -> str:
+    """The inverse of parse_script, runs of the same mask become one token."""
+    tokens = []
+    for mask in masks:
+        keys = "".join(k for k, key in SCRIPT_KEYS.items() if mask & key) or "-"
+        if tokens and tokens[-1][0] == keys:
+            tokens[-1][1] += 1
+        else:
+            tokens.append([keys, 1])
+    return ",".join(keys if count == 1 else f"{keys}*{count}" for keys, count in tokens)
+
+
+class HeadlessRunner:
+    def __init__(self, level_index: int = 0):
+        self.level_index = level_index
+        self.game = Game(prefetch=False)
+        self.keys = ScriptedKeys()
+
+    def run(self, inputs: Iterable[int] | Callable[[Game, int], int], max_ticks: int = None, stop_on_win=True):
+        """
+        Drives `Game.tick` from `inputs` (an iterable of key masks, or a callable
+        `(game, tick) -> mask`) until the script runs out, `max_ticks` is hit or
+        the level is won. Nothing is rendered. A policy never runs out, so it
+        needs `max_ticks`.
+        """
+        if callable(inputs) and max_ticks is None:
+            raise ValueError("max_ticks is required when inputs is a policy")
+        game = self.game
+        if game.load_level(self.level_index) < 0:
+            raise IndexError(f"no level with index {self.level_index}")
+        game.start()
+
+        if callable(inputs):
+            policy = inputs
+            source = iter(int, 1)  # endless
+        else:
+            policy = None
+            source = iter(inputs)
+
+        keys = self.keys
+        ticks = 0
+        start = time.perf_counter()
+        for mask in source:
+            if max_ticks is not None and ticks >= max_ticks:
+                break
+            keys.mask = policy(game, ticks) if policy else mask
+            game.process_keypresses(keys)
+            game.tick()
+            ticks += 1
+            if stop_on_win and game.flags & Game.Flags.WIN:
+                break
+        elapsed = time.perf_counter() - start
+
+        player = game.player
+        return {
+            "level": self.level_index,
+            "ticks": ticks,
+            "seconds": elapsed,
+            "ticks_per_second": ticks / elapsed if elapsed > 0 else float("inf"),
+            "won": bool(game.flags & Game.Flags.WIN),
+            "coins": player.coins_collected,
+            "lives": player.lives,
+            "pos": (player.rect.x, player.rect.y),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.headless", description="run a level without a window, as fast as possible")
+    parser.add_argument("--level", type=int, default=0,
+                        help="index into LEVELS")
+    parser.add_argument("--script", default="R*1000",
+                        help="comma separated <keys>*<ticks> tokens, keys from J/L/R or -")
+    parser.add_argument("--ticks", type=int, default=None,
+                        help="stop after this many ticks")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="number of playthroughs")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    try:
+        script = parse_script(args.script)
+    except ValueError as e:
+        parser.error(f"bad --script: {e}")
+    total_ticks = total_seconds = 0
+    for _ in range(args.repeat):
+        result = HeadlessRunner(args.level).run(script, args.ticks)
+        total_ticks += result["ticks"]
+        total_seconds += result["seconds"]
+
+    print(f"level {result['level']}: {result['ticks']} ticks, won={result['won']}, "
+          f"coins={result['coins']}, lives={result['lives']}, pos={result['pos']}")
+    print(f"{total_ticks} ticks in {total_seconds:.3f}s "
+          f"({total_ticks / total_seconds if total_seconds else float('inf'):.0f} ticks/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import time
+
+import yaml
+
+from . import *
+from .game import Game, LevelError
+from .streaming import STREAM_EXT
+
+# reloads the level being played whenever its yaml is saved, without losing
+# the player's position (see Game.reload_level). on with --watch
+#
+#   python -m ranny_parkour --watch
+
+POLL_INTERVAL = 0.5  # seconds between stats of the level file
+
+
+class LevelWatcher:
+    def __init__(self, game: Game, interval: float = POLL_INTERVAL):
+        self.game = game
+        self.interval = interval
+        self.next_poll = 0.0
+        self.level = None
+        self.stamp = None
+
+    def poll(self) -> bool:
+        """Call once a frame, returns True if the level was reloaded."""
+        now = time.monotonic()
+        if now < self.next_poll:
+            return False
+        self.next_poll = now + self.interval
+
+        level = self.game.level
+        path = getattr(level, "path", None)
+        if path is None or path.endswith(STREAM_EXT):
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False  # mid-save by an editor that replaces the file
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        if level is not self.level:
+            # just switched levels, changes count from now on
+            self.level, self.stamp = level, stamp
+            return False
+        if stamp == self.stamp:
+            return False
+        self.stamp = stamp
+
+        start = time.perf_counter()
+        try:
+            cells = self.game.reload_level()
+        except (LevelError, yaml.YAMLError, KeyError, TypeError, ValueError, OSError) as e:
+            # half written or broken, keep playing the old version
+            print(f"not reloading {os.path.basename(path)}: {e}")
+            return False
+        self.level = self.game.level
+        changed = "rebuilt" if cells is None else f"{len(cells)} cells changed"
+        print(f"reloaded {os.path.basename(path)}: {changed} "
+              f"in {(time.perf_counter() - start) * 1000:.1f}ms")
+        return True
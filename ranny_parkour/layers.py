@@ -0,0 +1,100 @@
+import pygame as pg
+
+from . import *
+from .misc import convert_opaque
+
+CHUNK_COLS = 8  # columns of blocks per chunk
+KEEP_CHUNKS = 2  # chunks kept baked on either side of the viewport
+
+
+class ChunkedLayer:
+    """
+    The static part of a level (background + blocks) split into fixed-width
+    column chunks. Chunks are baked the first time they come into view and
+    dropped again once the camera is far enough away, so memory and blit cost
+    follow the screen size instead of the level size. Chunks are opaque and
+    in the display format with the background composited in, so drawing
+    them is a plain copy of only the part the camera sees.
+    """
+
+    def __init__(self, level, chunk_cols: int = CHUNK_COLS, keep_chunks: int = KEEP_CHUNKS):
+        self.level = level
+        self.chunk_cols = chunk_cols
+        self.chunk_width = chunk_cols * BLOCK_SIZE
+        self.chunk_count = -(-level.cols // chunk_cols)
+        self.keep_chunks = keep_chunks
+        self.chunks: dict[int, pg.Surface] = {}
+
+    def chunk_range(self, viewport: pg.Rect) -> range:
+        first = max(viewport.left // self.chunk_width, 0)
+        last = min((viewport.right - 1) // self.chunk_width,
+                   self.chunk_count - 1)
+        return range(first, last + 1)
+
+    def bake(self, index: int) -> pg.Surface:
+        level = self.level
+        chunk_x = index * self.chunk_width
+        first_col = index * self.chunk_cols
+        last_col = min(first_col + self.chunk_cols, level.cols)
+
+        surf = pg.Surface(((last_col - first_col) * BLOCK_SIZE, level.height),
+                          0, COLOR_DEPTH)
+        surf.fill(pg.Color(*level.background_color)
+                  if level.background_color else BLACK)
+        if level.background_image is not None:
+            surf.blit(level.background_image, (-chunk_x, 0))
+
+        surf.blits([(image, (x - chunk_x, y)) for image, (x, y) in level.block_blits(first_col, last_col)],
+                   doreturn=False)
+        return convert_opaque(surf)
+
+    def redraw(self, cells: list[tuple[int, int]]):
+        """Repaints single (col, row) cells of the baked chunks, the others bake fresh when they come into view."""
+        level = self.level
+        for col, row in cells:
+            index = col // self.chunk_cols
+            surf = self.chunks.get(index)
+            if surf is None:
+                continue
+            chunk_x = index * self.chunk_width
+            rect = pg.Rect(col * BLOCK_SIZE - chunk_x,
+                           row * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)
+            surf.fill(pg.Color(*level.background_color)
+                      if level.background_color else BLACK, rect)
+            if level.background_image is not None:
+                surf.blit(level.background_image, rect, rect.move(chunk_x, 0))
+            for image, (x, y) in level.block_blits(col, col + 1):
+                if y == rect.y:
+                    surf.blit(image, rect)
+
+    def chunk(self, index: int) -> pg.Surface:
+        surf = self.chunks.get(index)
+        if surf is None:
+            surf = self.chunks[index] = self.bake(index)
+        return surf
+
+    def evict(self, keep: range):
+        for index in list(self.chunks):
+            if index < keep.start - self.keep_chunks or index >= keep.stop + self.keep_chunks:
+                del self.chunks[index]
+
+    def blits(self, viewport: pg.Rect, offset: tuple[float, float]) -> list[tuple[pg.Surface, tuple[float, float], pg.Rect]]:
+        """(surface, screen pos, area) for the visible part of each chunk intersecting `viewport`."""
+        visible = self.chunk_range(viewport)
+        self.evict(visible)
+        ox, oy = offset
+        blits = []
+        for i in visible:
+            chunk = self.chunk(i)
+            chunk_x = i * self.chunk_width
+            area = chunk.get_rect(x=chunk_x).clip(viewport)
+            blits.append((chunk, (area.x + ox, area.y + oy),
+                          area.move(-chunk_x, 0)))
+        return blits
+
+    def memory(self) -> int:
+        return sum(chunk.get_width() * chunk.get_height() * chunk.get_bytesize()
+                   for chunk in self.chunks.values())
+
+    def clear(self):
+        self.chunks.clear()
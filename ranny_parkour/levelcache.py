@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import yaml
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from . import *
+
+# compiled levels: the yaml minus the block string as json, plus the tiles as
+# one byte per cell. kept in the user cache and reused for as long as the
+# source file is unchanged (same mtime + size, or failing that, same sha1)
+# and was compiled by the same version of the compiler
+
+CACHE_DIR = os.path.join(CACHE_PATH, "levels")
+MAGIC = b"RPLV"
+FORMAT_VERSION = 2
+
+# magic, format version, compiler version, source mtime_ns, source size,
+# source sha1, meta length, tiles length
+HEADER = struct.Struct("<4sHHqQ20sII")
+
+MAX_CACHED_BYTES = 64 * 1024 * 1024  # constructed levels kept in memory
+
+Compiler = Callable[[dict], tuple[dict, bytes]]
+
+
+def cache_path(path: str) -> str:
+    path = os.path.abspath(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    key = hashlib.sha1(path.encode()).hexdigest()[:10]
+    return os.path.join(CACHE_DIR, f"{stem}-{key}.rpl")
+
+
+def parse_yaml(source: bytes) -> dict:
+    return yaml.load(source, getattr(yaml, "CLoader", yaml.Loader))
+
+
+def jsonable(value):
+    """`value` as it comes back out of the cache: yaml-only types (dates, sets, ...) become strings, tuples lists."""
+    if isinstance(value, dict):
+        return {key if isinstance(key, str) else str(key): jsonable(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+
+def pack(meta: dict, tiles: bytes, mtime_ns: int, size: int, digest: bytes,
+         compiler_version: int = 0) -> bytes:
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, compiler_version, mtime_ns, size,
+                         digest, len(meta_bytes), len(tiles))
+    return header + meta_bytes + tiles
+
+
+def unpack(blob: bytes) -> tuple[tuple, dict, bytes] | None:
+    if len(blob) < HEADER.size:
+        return None
+    header = HEADER.unpack_from(blob)
+    magic, version, *_, meta_len, tiles_len = header
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    if len(blob) != HEADER.size + meta_len + tiles_len:
+        return None
+    meta_end = HEADER.size + meta_len
+    meta = json.loads(blob[HEADER.size:meta_end])
+    return header, meta, blob[meta_end:]
+
+
+def write(path: str, blob: bytes):
+    # best effort, a read-only install just recompiles every time
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def compile_file(path: str, compiler: Compiler, write_cache=True,
+                 compiler_version: int = 0) -> tuple[dict, bytes]:
+    with open(path, "rb") as f:
+        source = f.read()
+    stat = os.stat(path)
+    meta, tiles = compiler(parse_yaml(source))
+    # the same values whether or not this load went through the cache
+    meta = jsonable(meta)
+    if write_cache:
+        digest = hashlib.sha1(source).digest()
+        write(cache_path(path),
+              pack(meta, tiles, stat.st_mtime_ns, stat.st_size, digest,
+                   compiler_version))
+    return meta, tiles
+
+
+def load(path: str, compiler: Compiler, compiler_version: int = 0) -> tuple[dict, bytes]:
+    """
+    (meta, tiles) for the level at `path`, from the cache when it is still
+    valid. Bump `compiler_version` whenever `compiler` changes what it
+    produces or accepts, older entries are then compiled again.
+    """
+    stat = os.stat(path)
+    compiled = cache_path(path)
+    try:
+        with open(compiled, "rb") as f:
+            cached = unpack(f.read())
+    except (OSError, ValueError):
+        cached = None
+
+    if cached is not None and cached[0][2] == compiler_version:
+        (_, _, _, mtime_ns, size, digest, *_), meta, tiles = cached
+        if mtime_ns == stat.st_mtime_ns and size == stat.st_size:
+            return meta, tiles
+
+        # touched but maybe not changed, compare contents before recompiling
+        with open(path, "rb") as f:
+            source = f.read()
+        if hashlib.sha1(source).digest() == digest:
+            write(compiled, pack(meta, tiles, stat.st_mtime_ns,
+                  stat.st_size, digest, compiler_version))
+            return meta, tiles
+
+    return compile_file(path, compiler, compiler_version=compiler_version)
+
+
+def clear():
+    try:
+        for name in os.listdir(CACHE_DIR):
+            if name.endswith(".rpl"):
+                os.remove(os.path.join(CACHE_DIR, name))
+    except OSError:
+        pass
+
+
+# ==================
+# In-memory cache
+# ==================
+
+prefetch_executor: ThreadPoolExecutor | None = None
+
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    global prefetch_executor
+    if prefetch_executor is None:
+        prefetch_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="level-prefetch")
+    return prefetch_executor
+
+
+class LevelCache:
+    """
+    Bounded LRU of constructed levels keyed by path. `prefetch` builds a level
+    on a background thread so a later `get` is a cache hit. Levels are
+    handed out as-is, callers reset them before playing.
+    """
+
+    def __init__(self, loader: Callable[[str], Any], max_bytes: int = MAX_CACHED_BYTES, prefetch=True):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.prefetch_enabled = prefetch
+        self.levels: OrderedDict[str, Any] = OrderedDict()
+        self.pending: dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def get(self, path: str):
+        with self.lock:
+            level = self.levels.get(path)
+            if level is not None:
+                self.levels.move_to_end(path)
+                return level
+            future = self.pending.get(path)
+
+        # already being built in the background, wait for it instead of building twice
+        level = future.result() if future is not None else self.loader(path)
+        self.put(path, level)
+        return level
+
+    def prefetch(self, path: str):
+        if not self.prefetch_enabled:
+            return
+        with self.lock:
+            if path in self.levels or path in self.pending:
+                return
+            future = get_prefetch_executor().submit(self.loader, path)
+            self.pending[path] = future
+        future.add_done_callback(lambda f: self.prefetched(path, f))
+
+    def prefetched(self, path: str, future: Future):
+        with self.lock:
+            self.pending.pop(path, None)
+        # errors surface when the level is actually asked for
+        if future.exception() is None:
+            self.put(path, future.result())
+
+    def put(self, path: str, level):
+        with self.lock:
+            self.levels[path] = level
+            self.levels.move_to_end(path)
+            self.evict()
+
+    def evict(self):
+        # never evicts the most recently used level, even if it alone is over the cap
+        total = sum(level.memory_estimate() for level in self.levels.values())
+        while total > self.max_bytes and len(self.levels) > 1:
+            _, level = self.levels.popitem(last=False)
+            total -= level.memory_estimate()
+
+    def clear(self):
+        with self.lock:
+            self.levels.clear()
@@ -0,0 +1,103 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from .. import *
+from .. import levelcache, streaming
+from ..game import Level, LevelError
+
+# validates and compiles level files across a process pool, without opening
+# a display or loading any assets. compiled levels land in the level cache,
+# so the game itself starts from them afterwards
+#
+#   python -m ranny_parkour.levels                    (everything in levels/)
+#   python -m ranny_parkour.levels generated/ extra.yaml --jobs 8
+
+LEVELS_DIR = os.path.dirname(os.path.abspath(__file__))
+LEVEL_PATTERNS = ("*.yaml", "*.yml", "*" + streaming.STREAM_EXT)
+
+
+def find_levels(paths: list[str]) -> list[str]:
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in LEVEL_PATTERNS:
+                found += glob.glob(os.path.join(path, "**", pattern), recursive=True)
+        else:
+            found.append(path)
+    return sorted(set(found))
+
+
+def check(path: str, write_cache=True) -> tuple[str, float, str | None]:
+    """(path, seconds, error or None) for one level file."""
+    start = time.perf_counter()
+    error = None
+    try:
+        if path.endswith(streaming.STREAM_EXT):
+            Level.check(streaming.read_meta(path))
+        else:
+            levelcache.compile_file(path, Level.compile, write_cache,
+                                    Level.COMPILER_VERSION)
+    except LevelError as e:
+        error = str(e)
+    except yaml.YAMLError as e:
+        error = f"invalid yaml: {e}"
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        # mostly yaml that parses but isn't shaped like a level
+        error = f"{type(e).__name__}: {e}"
+    return path, time.perf_counter() - start, error
+
+
+def check_all(paths: list[str], jobs: int = None, write_cache=True) -> list[tuple[str, float, str | None]]:
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(paths)))
+    if jobs == 1:
+        return [check(path, write_cache) for path in paths]
+    with ProcessPoolExecutor(jobs) as pool:
+        return list(pool.map(check, paths, [write_cache] * len(paths),
+                             chunksize=max(1, len(paths) // (jobs * 4))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.levels", description="validate and compile level files")
+    parser.add_argument("paths", nargs="*", default=[LEVELS_DIR],
+                        help="level files or directories (default: the shipped levels)")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="worker processes (default: one per cpu)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="only validate, don't write compiled levels")
+    parser.add_argument("--quiet", "-q", action="store_true",
+                        help="only print failures and the summary")
+    args = parser.parse_args(argv)
+
+    paths = find_levels(args.paths)
+    if not paths:
+        print("no level files found")
+        raise SystemExit(1)
+
+    start = time.perf_counter()
+    results = check_all(paths, args.jobs, not args.no_cache)
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    for path, seconds, error in results:
+        name = os.path.relpath(path)
+        if error is not None:
+            failed += 1
+            print(f"FAIL {seconds * 1000:8.2f}ms  {name}: {error}")
+        elif not args.quiet:
+            print(f"ok   {seconds * 1000:8.2f}ms  {name}")
+
+    total = sum(seconds for _, seconds, _ in results)
+    print(f"{len(results) - failed} ok, {failed} failed in {elapsed:.3f}s "
+          f"({total:.3f}s of work)")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
 import pygame as pg
+from collections import OrderedDict
+from typing import Callable, Hashable
 
 
 from . import *
 
 
-def load_image(path: str, width=BLOCK_SIZE, height=BLOCK_SIZE):
-    image = pg.image.load(path)
-    image = pg.transform.scale(image, (width, height))
-    return image.convert_alpha()
+def convert(image: pg.Surface):
+    # convert_alpha needs a video mode; headless tools just keep the raw surface
+    if pg.display.get_init() and pg.display.get_surface() is not None:
+        return image.convert_alpha()
+    return image
+
+
+def convert_opaque(image: pg.Surface):
+    # same, for surfaces without per-pixel alpha (fastest to blit to the screen)
+    if pg.display.get_init() and pg.display.get_surface() is not None:
+        return image.convert()
+    return image
 
 
 class SpriteSheet:
@@ -17,7 +27,7 @@ class SpriteSheet:
     def image_at(self, rect: pg.Rect):
         image = pg.Surface(rect.size)
         image.blit(self.sheet, (0, 0), rect)
-        return image.convert_alpha()
+        return convert(image)
 
     def images_at(self, rects: list[pg.Rect]):
         return [self.image_at(rect) for rect in rects]
@@ -25,3 +35,26 @@ class SpriteSheet:
     def load_strip(self, rect: pg.Rect, image_count):
         rects = [rect.copy().move(rect.width*i, 0) for i in range(image_count)]
         return self.images_at(rects)
+
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, factory: Callable[[], object]):
+        """The cached value for `key`, made with `factory()` on a miss."""
+        try:
+            self.items.move_to_end(key)
+            return self.items[key]
+        except KeyError:
+            value = self.items[key] = factory()
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+            return value
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,109 @@
+import time
+from array import array
+
+import pygame as pg
+
+from . import *
+from . import resources
+
+# per frame timings of each phase of App.run_loop, kept in a ring buffer.
+# App only touches this when profiling is on (--profile / --frame-times / F3)
+
+PHASES = ("events", "tick", "hud", "render", "flip")
+HISTORY = 2400  # frames, 20s at 120 fps
+OVERLAY_FONT_SIZE = 20
+OVERLAY_REFRESH = 15  # frames between overlay text updates
+
+
+class FrameTimer:
+    def __init__(self, size: int = HISTORY):
+        self.size = size
+        # row-major [frame][phase], milliseconds
+        self.samples = array("d", bytes(8 * size * len(PHASES)))
+        self.totals = array("d", bytes(8 * size))
+        self.index = 0
+        self.count = 0
+        self.phase = 0
+        self.last = 0.0
+        self.start = 0.0
+
+        self.overlay_visible = False
+        self.overlay_surf = None
+        self.overlay_rect = None
+
+    def begin(self):
+        self.phase = 0
+        self.start = self.last = time.perf_counter()
+
+    def mark(self):
+        """Ends the current phase (in PHASES order)."""
+        now = time.perf_counter()
+        self.samples[self.index * len(PHASES) + self.phase] = (now - self.last) * 1000
+        self.phase += 1
+        self.last = now
+
+    def end(self):
+        self.totals[self.index] = (self.last - self.start) * 1000
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def frames(self):
+        """Recorded frames, oldest first, as (total, [phase ms...])."""
+        first = (self.index - self.count) % self.size
+        n = len(PHASES)
+        for i in range(self.count):
+            frame = (first + i) % self.size
+            yield self.totals[frame], self.samples[frame * n:(frame + 1) * n]
+
+    def stats(self) -> dict:
+        if not self.count:
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0}
+        totals = sorted(total for total, _ in self.frames())
+        return {
+            "p50": totals[len(totals) // 2],
+            "p99": totals[min(len(totals) - 1, int(len(totals) * 0.99))],
+            "max": totals[-1],
+        }
+
+    def dump_csv(self, path: str):
+        with open(path, "w") as f:
+            f.write(",".join(("frame", "total_ms") +
+                    tuple(f"{phase}_ms" for phase in PHASES)) + "\n")
+            for i, (total, phases) in enumerate(self.frames()):
+                f.write(",".join([str(i), f"{total:.4f}"] +
+                        [f"{ms:.4f}" for ms in phases]) + "\n")
+
+    # ==================
+    # Overlay
+    # ==================
+
+    def toggle_overlay(self):
+        self.overlay_visible = not self.overlay_visible
+        self.overlay_surf = None
+
+    def update_overlay(self):
+        if self.overlay_surf is not None and self.index % OVERLAY_REFRESH:
+            return
+        stats = self.stats()
+        font = resources.font(OVERLAY_FONT_SIZE)
+        last = (self.index - 1) % self.size * len(PHASES)
+        lines = [
+            f"frame p50 {stats['p50']:.2f}  p99 {stats['p99']:.2f}  max {stats['max']:.2f} ms",
+            "  ".join(f"{phase} {self.samples[last + i]:.2f}" for i, phase in enumerate(PHASES)),
+        ]
+        images = [font.render(line, True, WHITE) for line in lines]
+        width = max(image.get_width() for image in images) + 16
+        height = sum(image.get_height() for image in images) + 12
+        self.overlay_surf = pg.Surface((width, height), pg.SRCALPHA, COLOR_DEPTH)
+        self.overlay_surf.fill((0, 0, 0, 160))
+        y = 6
+        for image in images:
+            self.overlay_surf.blit(image, (8, y))
+            y += image.get_height()
+        self.overlay_rect = self.overlay_surf.get_rect(
+            left=10, bottom=SCREEN_HEIGHT - 10)
+
+    def draw_overlay(self, surf: pg.Surface) -> pg.Rect:
+        self.update_overlay()
+        surf.blit(self.overlay_surf, self.overlay_rect)
+        return self.overlay_rect
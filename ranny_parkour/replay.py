@@ -0,0 +1,213 @@
+import argparse
+import json
+import struct
+import time
+import zlib
+
+from . import *
+from .game import Game, GameState
+from .headless import ScriptedKeys, parse_script
+
+# a run is recorded as one key mask per tick (see headless.Keys) plus a
+# checksum of the game state every `interval` ticks. replaying it headless
+# and comparing checksums catches physics changes without any screenshots
+#
+#   python -m ranny_parkour.replay record --level 0 --script "R*40,JR*20,R*300" run.rpr
+#   python -m ranny_parkour.replay verify run.rpr
+#
+# or record a real session with `python -m ranny_parkour --record run.rpr`
+
+MAGIC = b"RPRC"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHI")  # magic, format version, meta length
+CHECKSUM_INTERVAL = 60
+
+
+def checksum(state: GameState) -> int:
+    return zlib.crc32(repr(tuple(state)).encode())
+
+
+class Recording:
+    def __init__(self, level: int, level_version: str = None, game_version: str = VERSION,
+                 interval: int = CHECKSUM_INTERVAL, level_hash: str = None):
+        self.level = level
+        self.level_version = level_version
+        self.level_hash = level_hash  # Level.content_hash, the version field is hand edited
+        self.game_version = game_version
+        self.interval = interval
+        self.inputs = bytearray()
+        self.checksums: list[int] = []  # after tick interval, 2 * interval, ...
+        self.final: int | None = None
+
+    def to_bytes(self) -> bytes:
+        meta = json.dumps({
+            "level": self.level,
+            "level_version": self.level_version,
+            "level_hash": self.level_hash,
+            "game_version": self.game_version,
+            "interval": self.interval,
+            "ticks": len(self.inputs),
+            "checksums": self.checksums,
+            "final": self.final,
+        }, separators=(",", ":")).encode()
+        return HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)) + meta + zlib.compress(bytes(self.inputs), 9)
+
+    @staticmethod
+    def from_bytes(blob: bytes) -> 'Recording':
+        try:
+            magic, version, meta_len = HEADER.unpack_from(blob)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("not a recording, or from an unsupported version")
+        meta = json.loads(blob[HEADER.size:HEADER.size + meta_len])
+        recording = Recording(meta["level"], meta["level_version"],
+                              meta["game_version"], meta["interval"],
+                              meta.get("level_hash"))
+        recording.inputs = bytearray(zlib.decompress(
+            blob[HEADER.size + meta_len:]))
+        recording.checksums = meta["checksums"]
+        recording.final = meta["final"]
+        if len(recording.inputs) != meta["ticks"]:
+            raise ValueError("recording is truncated")
+        return recording
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def load(path: str) -> 'Recording':
+        with open(path, "rb") as f:
+            return Recording.from_bytes(f.read())
+
+
+class Recorder:
+    """Call `record(mask)` after every `Game.tick`, `finish()` once done."""
+
+    def __init__(self, game: Game, interval: int = CHECKSUM_INTERVAL):
+        self.game = game
+        self.interval = interval
+        self.start()
+
+    def start(self):
+        # (re)starts on whatever level the game is on now
+        level = self.game.level
+        self.recording = Recording(self.game.curr_level, level.version,
+                                   interval=self.interval, level_hash=level.content_hash)
+
+    def record(self, mask: int):
+        recording = self.recording
+        recording.inputs.append(mask)
+        if len(recording.inputs) % recording.interval == 0:
+            recording.checksums.append(checksum(self.game.snapshot()))
+
+    def finish(self) -> Recording:
+        self.recording.final = checksum(self.game.snapshot())
+        return self.recording
+
+
+def record(level: int, inputs: list[int], interval: int = CHECKSUM_INTERVAL) -> Recording:
+    game = Game(prefetch=False)
+    if game.load_level(level) < 0:
+        raise IndexError(f"no level with index {level}")
+    game.start()
+    recorder = Recorder(game, interval)
+    keys = ScriptedKeys()
+    for mask in inputs:
+        keys.mask = mask
+        game.process_keypresses(keys)
+        game.tick()
+        recorder.record(mask)
+    return recorder.finish()
+
+
+def verify(recording: Recording) -> dict:
+    """Replays `recording` headless. `ok` is False at the first checksum that does not match."""
+    game = Game(prefetch=False)
+    if game.load_level(recording.level) < 0:
+        raise IndexError(f"no level with index {recording.level}")
+    game.start()
+    result = {
+        "ok": True,
+        "ticks": len(recording.inputs),
+        "level_version": game.level.version,
+        "mismatch_tick": None,
+        "seconds": 0.0,
+    }
+    if recording.level_hash is not None and recording.level_hash != game.level.content_hash:
+        # it would only go out of sync somewhere, say why up front instead
+        result["ok"] = False
+        result["error"] = f"level {recording.level} changed since it was recorded"
+        return result
+    if recording.level_version != game.level.version:
+        result["warning"] = f"level version {recording.level_version} was recorded, " \
+            f"playing {game.level.version}"
+
+    keys = ScriptedKeys()
+    interval = recording.interval
+    checksums = iter(recording.checksums)
+    start = time.perf_counter()
+    for tick, mask in enumerate(recording.inputs, 1):
+        keys.mask = mask
+        game.process_keypresses(keys)
+        game.tick()
+        if tick % interval == 0 and next(checksums, None) != checksum(game.snapshot()):
+            result["ok"] = False
+            result["mismatch_tick"] = tick
+            break
+    else:
+        if recording.final is not None and recording.final != checksum(game.snapshot()):
+            result["ok"] = False
+            result["mismatch_tick"] = len(recording.inputs)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.replay", description="record and verify input replays")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="record a scripted run")
+    rec.add_argument("--level", type=int, default=0)
+    rec.add_argument("--script", required=True,
+                     help="same format as ranny_parkour.headless")
+    rec.add_argument("--interval", type=int, default=CHECKSUM_INTERVAL,
+                     help="ticks between checksums")
+    rec.add_argument("output")
+
+    ver = sub.add_parser("verify", help="replay recordings and compare checksums")
+    ver.add_argument("recordings", nargs="+")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        try:
+            inputs = parse_script(args.script)
+        except ValueError as e:
+            parser.error(f"bad --script: {e}")
+        recording = record(args.level, inputs, args.interval)
+        recording.save(args.output)
+        print(f"recorded {len(recording.inputs)} ticks on level {args.level} to {args.output}")
+        return
+
+    failed = 0
+    for path in args.recordings:
+        result = verify(Recording.load(path))
+        speedup = result["ticks"] / FPS / result["seconds"] if result["seconds"] else float("inf")
+        if "error" in result:
+            print(f"{path}: {result['error']}")
+            failed += 1
+            continue
+        status = "ok" if result["ok"] else f"MISMATCH at tick {result['mismatch_tick']}"
+        print(f"{path}: {status}, {result['ticks']} ticks in {result['seconds']:.3f}s ({speedup:.0f}x real time)")
+        if "warning" in result:
+            print(f"  warning: {result['warning']}")
+        failed += not result["ok"]
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import os
+import pygame as pg
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import cache, partial
+from typing import Callable
+
+from . import *
+from . import atlas
+from .misc import SpriteSheet, convert
+
+# every asset is loaded the first time something asks for it and then kept
+# around, so importing the game (or a level tool) costs next to nothing
+
+
+@cache
+def font(size: int) -> pg.font.Font:
+    if not pg.font.get_init():
+        pg.font.init()
+    return pg.font.Font(FONT_PATH, size)
+
+
+@cache
+def atlas_keys() -> frozenset[str]:
+    # what the atlas has, anything else (icon, backgrounds) never needs it loaded
+    from .game import sprite_spec
+    return frozenset(atlas.frame_key(loader, args) for loader, args in sprite_spec())
+
+
+def from_atlas(loader: str, args: tuple) -> list[pg.Surface] | None:
+    if atlas.frame_key(loader, args) not in atlas_keys():
+        return None
+    return atlas.get().get(loader, args)
+
+
+@cache
+def image(path: str, size: tuple[int, int] = None, flip=False) -> pg.Surface:
+    """`path` is relative to the package unless absolute. Scaled to `size` and mirrored if asked."""
+    frames = from_atlas("image", (path, size, flip))
+    if frames is not None:
+        return frames[0]
+    return load_image(path, size, flip)
+
+
+@cache
+def sheet_strip(path: str, rect: tuple[int, int, int, int], count: int, size: tuple[int, int], flip=False) -> list[pg.Surface]:
+    frames = from_atlas("sheet_strip", (path, rect, count, size, flip))
+    if frames is not None:
+        return frames
+    return load_sheet_strip(path, rect, count, size, flip)
+
+
+@cache
+def sprite_sheet(path: str) -> SpriteSheet:
+    return SpriteSheet(BASE_PATH + path)
+
+
+# the loaders below skip the atlas, atlas.py builds it with them
+
+def load_image(path: str, size: tuple[int, int] = None, flip=False) -> pg.Surface:
+    return convert(decode_image(read(path), size, flip))
+
+
+def load_sheet_strip(path: str, rect: tuple[int, int, int, int], count: int, size: tuple[int, int], flip=False) -> list[pg.Surface]:
+    return [convert(frame) for frame in decode_sheet_strip(sprite_sheet(path).sheet, rect, count, size, flip)]
+
+
+# decoding and scaling, without converting to the display format. these are
+# safe to run off the main thread, and pygame lets go of the GIL while doing it
+
+def read(path: str) -> pg.Surface:
+    return pg.image.load(path if os.path.isabs(path) else BASE_PATH + path)
+
+
+def decode_image(source: pg.Surface, size: tuple[int, int] = None, flip=False) -> pg.Surface:
+    if size is not None:
+        source = pg.transform.scale(source, size)
+    if flip:
+        source = pg.transform.flip(source, 1, 0)
+    return source
+
+
+def decode_sheet_strip(sheet: pg.Surface, rect: tuple[int, int, int, int], count: int, size: tuple[int, int], flip=False) -> list[pg.Surface]:
+    rect = pg.Rect(rect)
+    frames = []
+    for i in range(count):
+        # copied out onto an opaque surface, like SpriteSheet.image_at
+        frame = pg.Surface(rect.size)
+        frame.blit(sheet, (0, 0), rect.move(rect.width * i, 0))
+        frames.append(decode_image(frame, size, flip))
+    return frames
+
+
+def decode_source(path: str, entries: list[tuple[str, tuple]]) -> list[list[pg.Surface]]:
+    """Frames of every (loader, args) entry cut from the image at `path`, which is read once."""
+    source = read(path)
+    decoded = []
+    for loader, args in entries:
+        if loader == "image":
+            decoded.append([decode_image(source, *args[1:])])
+        else:
+            decoded.append(decode_sheet_strip(source, *args[1:]))
+    return decoded
+
+
+def icon() -> pg.Surface:
+    return image(ICON_PATH)
+
+
+def clear():
+    for loader in (font, image, sprite_sheet, sheet_strip, atlas_keys):
+        loader.cache_clear()
+    atlas.clear()
+
+
+class Preloader:
+    """
+    Loads what the first frame needs before it is drawn. Images are decoded
+    and scaled on a thread pool, one task per source file, then converted to
+    the display format on the main thread and installed as the atlas (an up
+    to date atlas is a single image to decode). Fonts are opened on the main
+    thread while the pool works, SDL_ttf shares one FreeType library between
+    them. Call `step` between frames of a loading screen until it returns
+    True, or `wait` to just block.
+    """
+
+    def __init__(self, jobs: int = None, font_sizes: tuple[int, ...] = (FONT_SM, FONT_MD, FONT_LG)):
+        from .game import sprite_spec
+        self.spec = sprite_spec()
+        self.fonts = list(font_sizes)
+        self.pool = ThreadPoolExecutor(
+            jobs or os.cpu_count() or 1, thread_name_prefix="asset-decode")
+        self.pending: dict[Future, Callable] = {}
+        self.images: list[list[pg.Surface] | None] | None = None
+
+        found = atlas.find(self.spec)
+        if found is not None:
+            index, image = found
+            self.submit(partial(self.loaded_atlas, index["frames"]), read, image)
+        else:
+            # no usable atlas, load the sprites themselves and pack them at the end
+            self.images = [None] * len(self.spec)
+            by_source: dict[str, list[int]] = {}
+            for i, (_, args) in enumerate(self.spec):
+                by_source.setdefault(args[0], []).append(i)
+            for path, entries in by_source.items():
+                self.submit(partial(self.loaded_source, entries), decode_source,
+                            path, [self.spec[i] for i in entries])
+
+        self.total = len(self.pending) + len(self.fonts) + (self.images is not None)
+        self.done = 0
+
+    @property
+    def progress(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+    def submit(self, finish: Callable, fn: Callable, *args):
+        # `finish` gets the result on the main thread
+        self.pending[self.pool.submit(fn, *args)] = finish
+
+    def loaded_atlas(self, frames: dict, surf: pg.Surface):
+        atlas.install(atlas.Atlas(convert(surf), frames))
+
+    def loaded_source(self, entries: list[int], decoded: list[list[pg.Surface]]):
+        if self.images is None:
+            return  # another source failed, nothing gets packed
+        for i, frames in zip(entries, decoded):
+            self.images[i] = [convert(frame) for frame in frames]
+
+    def step(self, timeout: float | None = 1 / FPS) -> bool:
+        """Does a bit of main thread work, waiting at most `timeout` for the pool. True once everything is loaded."""
+        if self.fonts:
+            font(self.fonts.pop(0))
+            self.done += 1
+        elif self.pending:
+            finished, _ = wait(self.pending, timeout, FIRST_COMPLETED)
+            for future in finished:
+                finish = self.pending.pop(future)
+                self.done += 1
+                try:
+                    result = future.result()
+                except (OSError, pg.error):
+                    # left to the lazy loaders, which fail (or rebuild) the usual way
+                    if self.images is not None:
+                        self.images = None
+                        self.done += 1
+                    continue
+                finish(result)
+        elif self.images is not None:
+            built = atlas.build(self.spec, images=self.images)
+            atlas.cache(built, self.spec)
+            atlas.install(built)
+            self.images = None
+            self.done += 1
+        else:
+            self.pool.shutdown()
+            return True
+        return False
+
+    def wait(self):
+        while not self.step(None):
+            pass
+
+
+class LazyImage:
+    """Class attribute that only loads its image the first time it is read."""
+
+    def __init__(self, path: str, size: tuple[int, int] = (BLOCK_SIZE, BLOCK_SIZE)):
+        self.path = path
+        self.size = size
+
+    def __get__(self, obj, owner=None) -> pg.Surface:
+        return image(self.path, self.size)
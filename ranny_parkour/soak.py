@@ -0,0 +1,308 @@
+import argparse
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, NamedTuple
+
+from . import *
+from .game import Game
+from .headless import Keys, ScriptedKeys, format_script
+
+# drives every level with random (and deliberately nasty) input for as long
+# as asked, checking the physics invariants after every tick. the first
+# violation of a run stops it, and its inputs are shrunk to a short sequence
+# that still breaks the same invariant, printed as a headless script
+#
+#   python -m ranny_parkour.soak                          (a quick pass)
+#   python -m ranny_parkour.soak --ticks 1000000 --runs 8 --jobs 8
+
+SOAK_TICKS = FPS * 60 * 5  # per run
+SOAK_RUNS = 2  # per level and strategy
+MINIMIZE_TESTS = 1000  # replays spent shrinking one failure
+
+MOVES = [Keys.NONE, Keys.LEFT, Keys.RIGHT, Keys.JUMP,
+         Keys.JUMP | Keys.LEFT, Keys.JUMP | Keys.RIGHT]
+
+
+# ==================
+# Inputs
+# ==================
+
+def hold(rng: random.Random) -> Iterator[int]:
+    # roughly how people play: a key combination for a while, then another
+    while True:
+        mask = int(rng.choice(MOVES))
+        for _ in range(rng.randint(1, FPS)):
+            yield mask
+
+
+def mash(rng: random.Random) -> Iterator[int]:
+    # any combination every tick, LEFT and RIGHT together included
+    while True:
+        yield rng.randrange(8)
+
+
+def wiggle(rng: random.Random) -> Iterator[int]:
+    # turning around every tick or two while jumping, what finds corners
+    right = True
+    while True:
+        right = not right
+        mask = Keys.RIGHT if right else Keys.LEFT
+        if rng.random() < 0.3:
+            mask |= Keys.JUMP
+        for _ in range(rng.randint(1, 3)):
+            yield int(mask)
+
+
+STRATEGIES = {"hold": hold, "mash": mash, "wiggle": wiggle}
+
+
+# ==================
+# Invariants
+# ==================
+
+class Violation(NamedTuple):
+    tick: int  # since the level was (re)started, 1 is the first
+    kind: str
+    detail: str
+
+
+class Checker:
+    """The invariants, checked after every tick of `game`. Call `reset` whenever the level restarts."""
+
+    def __init__(self, game: Game):
+        self.game = game
+        self.reset()
+
+    def reset(self):
+        self.lives = self.game.player.lives
+
+    def __call__(self) -> tuple[str, str] | None:
+        player, level = self.game.player, self.game.level
+        rect = player.rect
+
+        if rect.left < 0 or rect.right > level.width:
+            return "out of bounds", f"player at {rect} in a level {level.width}px wide"
+        blocks = level.blocks_in_rect(rect)
+        if blocks:
+            return "embedded", f"player at {rect} overlaps the block at {blocks[0].rect}"
+        if not player.vy <= level.terminal_velocity:
+            return "too fast", f"vy {player.vy} above terminal velocity {level.terminal_velocity}"
+
+        remaining = level.coin_mask().bit_count()
+        if player.coins_collected < 0 or player.coins_collected != level.total_coins - remaining:
+            return "coins", (f"{player.coins_collected} collected, "
+                             f"{remaining} of {level.total_coins} left")
+
+        # there is no game over so lives may go below zero, but one death at a time
+        lost, self.lives = self.lives - player.lives, player.lives
+        if lost < 0:
+            return "lives", f"gained {-lost} lives"
+        if lost > 1:
+            return "lives", f"lost {lost} lives in one tick"
+        if lost and rect.topleft != level.player_respawn_pos:
+            return "lives", f"died but ended the tick at {rect.topleft}, not the respawn point"
+        return None
+
+
+def step(game: Game, keys: ScriptedKeys, mask: int):
+    keys.mask = mask
+    game.process_keypresses(keys)
+    game.tick()
+
+
+def reproduce(game: Game, level_index: int, inputs: list[int]) -> Violation | None:
+    """Plays `inputs` from the start of the level, the first violation they cause, if any."""
+    game.load_level(level_index)
+    game.start()
+    check = Checker(game)
+    keys = ScriptedKeys()
+    for tick, mask in enumerate(inputs, 1):
+        step(game, keys, mask)
+        failed = check()
+        if failed:
+            return Violation(tick, *failed)
+    return None
+
+
+# ==================
+# Minimizing
+# ==================
+
+def ddmin(items: list, fails, budget: list[int]) -> list:
+    """
+    Delta debugging: drops ever smaller chunks of `items` for as long as
+    `fails(rest)` stays true. `budget` is a one item list of tests left.
+    """
+    n = 2
+    while len(items) >= 2 and budget[0] > 0:
+        size = -(-len(items) // n)
+        for start in range(0, len(items), size):
+            rest = items[:start] + items[start + size:]
+            budget[0] -= 1
+            if fails(rest):
+                items = rest
+                n = max(n - 1, 2)
+                break
+            if budget[0] <= 0:
+                break
+        else:
+            if n >= len(items):
+                break
+            n = min(n * 2, len(items))
+    return items
+
+
+def runs_of(inputs: list[int]) -> list[tuple[int, int]]:
+    runs = []
+    for mask in inputs:
+        if runs and runs[-1][0] == mask:
+            runs[-1] = (mask, runs[-1][1] + 1)
+        else:
+            runs.append((mask, 1))
+    return runs
+
+
+def expand(runs: list[tuple[int, int]]) -> list[int]:
+    return [mask for mask, count in runs for _ in range(count)]
+
+
+def minimize(game: Game, level_index: int, inputs: list[int], kind: str,
+             tests: int = MINIMIZE_TESTS) -> tuple[list[int], Violation]:
+    """The shortest inputs found that still break the `kind` invariant, and how they break it."""
+    def fails(candidate: list[int]) -> bool:
+        violation = reproduce(game, level_index, candidate)
+        return violation is not None and violation.kind == kind
+
+    budget = [tests]
+    # whole key presses first (cheap, big steps), then single ticks
+    inputs = expand(ddmin(runs_of(inputs), lambda runs: fails(expand(runs)), budget))
+    inputs = ddmin(inputs, fails, budget)
+    violation = reproduce(game, level_index, inputs)
+    return inputs[:violation.tick], violation
+
+
+# ==================
+# Soaking
+# ==================
+
+class Failure(NamedTuple):
+    violation: Violation
+    inputs: list[int]  # minimized, from the start of the level
+    original_ticks: int  # how many it took before minimizing
+
+
+class RunResult(NamedTuple):
+    level: int
+    strategy: str
+    seed: int
+    ticks: int
+    seconds: float
+    worker: int  # pid
+    restarts: int  # wins and falls out of the level, both start the level over
+    failure: Failure | None
+
+
+def soak(level_index: int, strategy: str, seed: int, ticks: int = SOAK_TICKS,
+         minimize_tests: int = MINIMIZE_TESTS) -> RunResult:
+    """One run, in a worker process. Stops at the first violation."""
+    game = Game(prefetch=False)
+    game.load_level(level_index)
+    game.start()
+    check = Checker(game)
+    keys = ScriptedKeys()
+    masks = STRATEGIES[strategy](random.Random(seed))
+    inputs: list[int] = []  # since the level last started
+    restarts = 0
+
+    start = time.perf_counter()
+    for tick in range(ticks):
+        mask = next(masks)
+        inputs.append(mask)
+        step(game, keys, mask)
+        failed = check()
+        if failed:
+            elapsed = time.perf_counter() - start
+            shrunk, violation = minimize(game, level_index, inputs, failed[0], minimize_tests)
+            return RunResult(level_index, strategy, seed, tick + 1, elapsed, os.getpid(),
+                             restarts, Failure(violation, shrunk, len(inputs)))
+
+        # falling below the level never ends, so it counts as a restart like winning does
+        if game.flags & Game.Flags.WIN or game.player.rect.top > game.level.height:
+            game.reset()
+            check.reset()
+            inputs.clear()
+            restarts += 1
+
+    return RunResult(level_index, strategy, seed, ticks, time.perf_counter() - start,
+                     os.getpid(), restarts, None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.soak", description="fuzz the physics with random input and check invariants every tick")
+    parser.add_argument("--levels", type=int, nargs="*", default=range(len(LEVELS)),
+                        help="indexes into LEVELS (default: all of them)")
+    parser.add_argument("--strategies", nargs="*", choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--ticks", type=int, default=SOAK_TICKS,
+                        help="ticks per run")
+    parser.add_argument("--runs", type=int, default=SOAK_RUNS,
+                        help="runs (seeds) per level and strategy")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the first run, the others count up from it")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="worker processes (default: one per cpu)")
+    parser.add_argument("--minimize-tests", type=int, default=MINIMIZE_TESTS,
+                        help="replays spent shrinking each failure")
+    args = parser.parse_args(argv)
+
+    tasks = [(level, strategy, args.seed + run)
+             for level in args.levels for strategy in args.strategies for run in range(args.runs)]
+    if not tasks:
+        parser.error("nothing to run")
+    levels, strategies, seeds = zip(*tasks)
+    n = len(tasks)
+    jobs = max(1, min(args.jobs or os.cpu_count() or 1, n))
+
+    start = time.perf_counter()
+    if jobs == 1:
+        results = list(map(soak, levels, strategies, seeds,
+                           [args.ticks] * n, [args.minimize_tests] * n))
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(soak, levels, strategies, seeds,
+                                    [args.ticks] * n, [args.minimize_tests] * n))
+    elapsed = time.perf_counter() - start
+
+    workers = defaultdict(lambda: [0, 0, 0.0])  # runs, ticks, seconds
+    for result in results:
+        worker = workers[result.worker]
+        worker[0] += 1
+        worker[1] += result.ticks
+        worker[2] += result.seconds
+    for pid, (runs, ticks, seconds) in sorted(workers.items()):
+        print(f"worker {pid}: {runs} runs, {ticks} ticks in {seconds:.2f}s "
+              f"({ticks / seconds if seconds else float('inf'):.0f} ticks/s)")
+
+    failures = [result for result in results if result.failure]
+    for result in failures:
+        violation, inputs, original = result.failure
+        print(f"FAIL level {result.level} {result.strategy} seed {result.seed}: "
+              f"{violation.kind} at tick {violation.tick} ({violation.detail}), "
+              f"shrunk from {original} to {len(inputs)} ticks")
+        print(f"  python -m ranny_parkour.headless --level {result.level} "
+              f"--script \"{format_script(inputs)}\"")
+
+    ticks = sum(result.ticks for result in results)
+    restarts = sum(result.restarts for result in results)
+    print(f"{len(results) - len(failures)} runs ok, {len(failures)} failed: "
+          f"{ticks} ticks ({restarts} restarts) in {elapsed:.2f}s "
+          f"({ticks / elapsed if elapsed else float('inf'):.0f} ticks/s)")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
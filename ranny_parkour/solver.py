@@ -0,0 +1,261 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from . import *
+from .batch import BatchSim, IDLE, JUMPING
+from .game import Game, Level
+from .headless import Keys, ScriptedKeys, format_script
+
+# proves levels can be finished and finds the par time: the fewest ticks from
+# the start to touching an endpoint. breadth first over every distinct
+# movement state (position, velocity, grounded, jumping), one tick per layer,
+# each layer stepped as a whole through BatchSim so it is the exact Player
+# physics. a state seen in an earlier tick is never expanded again, and
+# states that fall out of the level are dropped, so a level with no solution
+# runs out of new states instead of running forever. dying in lava is just a
+# move to the respawn point (there is no game over), lives are not part of
+# the state, so routes through a respawn are found too
+#
+# states are only merged when they are exactly equivalent: vx is overwritten
+# by the next input unless the player is in the air with no key held, so it
+# only counts while jumping. there is no dominance pruning beyond that, with
+# ceilings, lava and pixel rounding a faster or higher state is not always
+# better, so dropping one could change the par time
+#
+# without pruning the search grows with the level, a few hundred states per
+# tile cell for the shipped ones. the state budget scales with the size of
+# the level up to MAX_STATES (a couple of GB of keys and parents), so levels
+# much past 20k cells of open play are out of scope and come back UNKNOWN
+#
+#   python -m ranny_parkour.solver                       (the shipped levels)
+#   python -m ranny_parkour.solver generated/*.yaml --jobs 8 --inputs
+
+# everything process_keypresses can tell apart, LEFT wins over RIGHT anyway
+ACTIONS = np.array([Keys.NONE, Keys.LEFT, Keys.RIGHT, Keys.JUMP,
+                    Keys.JUMP | Keys.LEFT, Keys.JUMP | Keys.RIGHT], dtype=np.uint8)
+
+MAX_TICKS = FPS * 60 * 30  # half an hour of play
+MAX_STATES_PER_CELL = 500  # about twice what the shipped levels need
+MIN_STATES = 20_000_000
+MAX_STATES = 100_000_000
+
+# state key bit layout, see StateKeys
+Y_BITS = 21
+VY_BITS = 12
+FLAG_BITS = 4
+
+
+class StateKeys:
+    """
+    Packs movement states into one int64 each, so a layer can be deduplicated
+    with np.unique. vy can be any float, so it goes through a table of the
+    values seen so far (a level only ever produces a few dozen).
+    """
+
+    def __init__(self):
+        self.vy_ids: dict[float, int] = {}
+
+    def __call__(self, x, y, vx, vy, grounded, state) -> np.ndarray:
+        values, inverse = np.unique(vy, return_inverse=True)
+        ids = np.array([self.vy_ids.setdefault(v, len(self.vy_ids)) for v in values.tolist()],
+                       dtype=np.int64)
+        if len(self.vy_ids) > 1 << VY_BITS:
+            raise ValueError("too many distinct vertical speeds to search")
+
+        # vx only carries over to the next tick while jumping, see process_keypresses
+        jumping = state == JUMPING
+        flags = (np.where(jumping, np.sign(vx), 0).astype(np.int64) + 1) << 2 \
+            | grounded.astype(np.int64) << 1 | jumping.astype(np.int64)
+        key = x.astype(np.int64) << Y_BITS | (y.astype(np.int64) + (1 << (Y_BITS - 1)))
+        key = key << VY_BITS | ids[inverse.ravel()]
+        return key << FLAG_BITS | flags
+
+
+class KeySet:
+    """
+    Set of int64 keys as sorted runs that are merged like a binary counter,
+    so inserting stays cheap however many keys there are and membership
+    tests are a searchsorted per run.
+    """
+
+    def __init__(self):
+        self.runs: list[np.ndarray] = []  # largest first
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            pos = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+            found |= run[pos] == keys
+        return found
+
+    def add(self, keys: np.ndarray):
+        """`keys` must be sorted, unique and not in the set yet."""
+        run = keys
+        while self.runs and len(self.runs[-1]) <= len(run):
+            # two sorted runs, a stable sort merges them in linear time
+            run = np.sort(np.concatenate((self.runs.pop(), run)), kind="stable")
+        self.runs.append(run)
+
+
+def state_budget(level: Level) -> int:
+    """How many states `solve` explores in `level` before giving up."""
+    cells = level.rows * level.cols
+    return min(max(cells * MAX_STATES_PER_CELL, MIN_STATES), MAX_STATES)
+
+
+class Solution(NamedTuple):
+    solvable: bool | None  # None when the search hit a limit before deciding
+    par_ticks: int | None
+    inputs: list[int]  # key masks of a fastest run
+    states: int  # distinct states explored
+    ticks_searched: int
+
+
+def solve(level: Level, max_ticks: int = MAX_TICKS, max_states: int | None = None) -> Solution:
+    """`max_states` defaults to the `state_budget` of the level."""
+    if max_states is None:
+        max_states = state_budget(level)
+    sim = BatchSim(level, 1, track_coins=False)
+    pack = StateKeys()
+    actions = len(ACTIONS)
+
+    x, y = level.player_starting_pos
+    frontier = (np.array([x]), np.array([y]), np.zeros(1), np.zeros(1),
+                np.zeros(1, dtype=bool), np.full(1, IDLE, dtype=np.int8))
+    visited = KeySet()
+    visited.add(pack(*frontier))
+    # per tick: for each state of that tick, the index of the state it came from and the action
+    parents: list[np.ndarray] = []
+    moves: list[np.ndarray] = []
+    explored = 1
+
+    for tick in range(1, max_ticks + 1):
+        n = len(frontier[0])
+        sim.load(*(np.repeat(values, actions) for values in frontier))
+        sim.step(np.tile(ACTIONS, n))
+        parent = np.repeat(np.arange(n, dtype=np.int32), actions)
+        move = np.tile(np.arange(actions, dtype=np.uint8), n)
+
+        if sim.won.any():
+            parents.append(parent)
+            moves.append(move)
+            i = int(np.flatnonzero(sim.won)[0])
+            inputs = []
+            for k in range(len(parents) - 1, -1, -1):
+                inputs.append(int(ACTIONS[moves[k][i]]))
+                i = int(parents[k][i])
+            inputs.reverse()
+            return Solution(True, tick, inputs, explored, tick)
+
+        # falling below the level never ends, dying just moves to the respawn point
+        keep = np.flatnonzero(sim.y < level.height)
+        keys = pack(sim.x, sim.y, sim.vx, sim.vy,
+                    sim.grounded, sim.state)[keep]
+        keys, first = np.unique(keys, return_index=True)
+        keep = keep[first]
+
+        # only states no earlier tick reached
+        new = ~visited.contains(keys)
+        keys, keep = keys[new], keep[new]
+        if not len(keys):
+            return Solution(False, None, [], explored, tick)
+
+        visited.add(keys)
+        explored += len(keys)
+        frontier = (sim.x[keep], sim.y[keep], sim.vx[keep], sim.vy[keep],
+                    sim.grounded[keep], sim.state[keep])
+        parents.append(parent[keep])
+        moves.append(move[keep])
+        if explored > max_states:
+            return Solution(None, None, [], explored, tick)
+
+    return Solution(None, None, [], explored, max_ticks)
+
+
+def replay(level: Level, inputs: list[int]) -> bool:
+    """Plays `inputs` through a real Game, True if it wins on exactly the last tick."""
+    game = Game(prefetch=False)
+    game.set_level(level)
+    keys = ScriptedKeys()
+    for tick, mask in enumerate(inputs, 1):
+        keys.mask = mask
+        game.process_keypresses(keys)
+        game.tick()
+        if game.flags & Game.Flags.WIN:
+            return tick == len(inputs)
+    return False
+
+
+def analyze(path: str, max_ticks: int = MAX_TICKS, max_states: int | None = None) -> tuple[str, float, Solution | None, str | None]:
+    """(path, seconds, solution, error) for one level file, runs in the worker processes."""
+    start = time.perf_counter()
+    try:
+        level = Level.from_file(path)
+        solution = solve(level, max_ticks, max_states)
+        if solution.solvable and not replay(level, solution.inputs):
+            return path, time.perf_counter() - start, solution, "solution does not replay in Game"
+        return path, time.perf_counter() - start, solution, None
+    except Exception as e:
+        return path, time.perf_counter() - start, None, f"{type(e).__name__}: {e}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.solver", description="check levels can be finished and find their par times")
+    parser.add_argument("paths", nargs="*", default=LEVELS,
+                        help="level files (default: the shipped levels)")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="worker processes (default: one per cpu)")
+    parser.add_argument("--max-ticks", type=int, default=MAX_TICKS)
+    parser.add_argument("--max-states", type=int, default=None,
+                        help="states explored per level before giving up "
+                             f"(default: {MAX_STATES_PER_CELL} per tile cell, "
+                             f"{MIN_STATES} to {MAX_STATES})")
+    parser.add_argument("--inputs", action="store_true",
+                        help="print the inputs of a fastest run (ranny_parkour.headless script format)")
+    args = parser.parse_args(argv)
+
+    jobs = max(1, min(args.jobs or os.cpu_count() or 1, len(args.paths)))
+    start = time.perf_counter()
+    if jobs == 1:
+        results = [analyze(path, args.max_ticks, args.max_states)
+                   for path in args.paths]
+    else:
+        n = len(args.paths)
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(analyze, args.paths, [args.max_ticks] * n,
+                                    [args.max_states] * n))
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    for path, seconds, solution, error in results:
+        name = os.path.relpath(path)
+        if error is not None:
+            status = f"ERROR {error}"
+        elif solution.solvable:
+            status = f"par {solution.par_ticks} ticks ({solution.par_ticks / FPS:.2f}s)"
+        elif solution.solvable is False:
+            status = "UNSOLVABLE"
+        else:
+            status = f"UNKNOWN, gave up after {solution.ticks_searched} ticks"
+        failed += error is not None or not solution.solvable
+        states = f"{solution.states} states, " if solution else ""
+        print(f"{name}: {status}  ({states}{seconds:.2f}s)")
+        if args.inputs and solution and solution.solvable:
+            print(f"  {format_script(solution.inputs)}")
+
+    print(f"{len(results) - failed} solvable, {failed} not in {elapsed:.2f}s")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from itertools import count
+
+import pygame as pg
+
+from . import *
+
+CELL_SIZE = 4 * BLOCK_SIZE
+
+
+class SpatialGroup(pg.sprite.Group):
+    """
+    A sprite group that also buckets its sprites by the grid cells their rect
+    covers, so "what is near this rect" only looks at nearby sprites instead
+    of all of them. Sprites that move call `relocate` afterwards (see
+    Entity.moved). Query results come back in the order the sprites were
+    added, the same order iterating the group gives.
+    """
+
+    def __init__(self, *sprites, cell_size: int = CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], set[pg.sprite.Sprite]] = {}
+        self.sprite_cells: dict[pg.sprite.Sprite, tuple[int, int, int, int]] = {}
+        self.order: dict[pg.sprite.Sprite, int] = {}
+        self.counter = count()
+        super().__init__(*sprites)
+
+    def cell_range(self, rect: pg.Rect) -> tuple[int, int, int, int]:
+        size = self.cell_size
+        return (rect.left // size, rect.top // size,
+                (rect.right - 1) // size, (rect.bottom - 1) // size)
+
+    def index(self, sprite, cells: tuple[int, int, int, int]):
+        left, top, right, bottom = cells
+        for cy in range(top, bottom + 1):
+            for cx in range(left, right + 1):
+                self.cells.setdefault((cx, cy), set()).add(sprite)
+        self.sprite_cells[sprite] = cells
+
+    def unindex(self, sprite):
+        left, top, right, bottom = self.sprite_cells.pop(sprite)
+        for cy in range(top, bottom + 1):
+            for cx in range(left, right + 1):
+                bucket = self.cells[cx, cy]
+                bucket.discard(sprite)
+                if not bucket:
+                    del self.cells[cx, cy]
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.order[sprite] = next(self.counter)
+        self.index(sprite, self.cell_range(sprite.rect))
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        del self.order[sprite]
+        self.unindex(sprite)
+
+    def relocate(self, sprite):
+        """Re-buckets `sprite` after its rect changed, cheap if it stayed in the same cells."""
+        cells = self.cell_range(sprite.rect)
+        if self.sprite_cells.get(sprite) != cells and sprite in self.sprite_cells:
+            self.unindex(sprite)
+            self.index(sprite, cells)
+
+    def near(self, rect: pg.Rect) -> list:
+        """Sprites in the cells `rect` covers, a superset of the ones overlapping it."""
+        left, top, right, bottom = self.cell_range(rect)
+        cells = self.cells
+        found = set()
+        for cy in range(top, bottom + 1):
+            for cx in range(left, right + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    found.update(bucket)
+        return sorted(found, key=self.order.__getitem__)
+
+    def query(self, rect: pg.Rect) -> list:
+        """Sprites whose rect overlaps `rect`."""
+        return [sprite for sprite in self.near(rect) if sprite.rect.colliderect(rect)]
+
+    def collide(self, sprite) -> list:
+        """What pg.sprite.spritecollide(sprite, self, False) returns, without the full scan."""
+        return self.query(sprite.rect)
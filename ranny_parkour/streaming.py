@@ -0,0 +1,399 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+from functools import cached_property
+from itertools import accumulate
+from typing import Iterable, NamedTuple
+
+import pygame as pg
+
+from . import *
+from . import levelcache
+from .game import (SPRITE_BYTES, TILE_COIN, TILE_EMPTY, TILE_INVALID, TILE_TABLE,
+                   Coin, Endpoint, Level, TileHit, block_image)
+from .layers import ChunkedLayer
+from .spatial import SpatialGroup
+
+# levels too long to keep in memory (endurance levels run to hundreds of
+# thousands of columns). tiles are stored column-major, so a run of columns is
+# one contiguous slice of the file. the file is memory mapped and read a chunk
+# of columns at a time around the player, only those chunks have tiles in
+# memory and coins/endpoints as sprites
+#
+#   python -m ranny_parkour.streaming build levels/endurance.yaml levels/endurance.rpls
+#   python -m ranny_parkour.streaming info levels/endurance.rpls
+#
+# Level.from_file opens .rpls files as a StreamingLevel, so they can go in
+# LEVELS. the batch tools (batch, env, solver, soak) work on them too, but
+# they read the whole tile grid into memory once
+
+STREAM_EXT = ".rpls"
+MAGIC = b"RPLS"
+FORMAT_VERSION = 1
+
+# magic, format version, rows, cols, chunk cols, meta length. after it come
+# the tiles (column-major), coins per row before each chunk plus the row
+# totals (uint32 each), and the level yaml minus the block string as json
+HEADER = struct.Struct("<4sHIIII")
+
+STREAM_CHUNK_COLS = 32
+STREAM_MARGIN = SCREEN_WIDTH  # px on either side of the player kept resident, covers the viewport
+KEEP_STREAM_CHUNKS = 1  # chunks past the margin kept before they are released
+
+VALID_TILES = bytes(sorted(set(TILE_TABLE) - {TILE_INVALID}))
+ENTITY_PATTERN = re.compile(rb"[\x0a\x0b]")  # TILE_COIN, TILE_ENDPOINT
+COIN_PATTERN = re.compile(rb"\x0a")
+
+
+def write(path: str, data: dict, rows: int, columns: Iterable[bytes], chunk_cols: int = STREAM_CHUNK_COLS) -> int:
+    """
+    Writes a streamed level from `columns` (compiled tiles of one column, top
+    to bottom), holding no more than a chunk of them at a time. `data` is the
+    level yaml minus the block string. Returns the number of columns.
+    """
+    row_coins = [0] * rows
+    counts = []
+    chunk = []
+    cols = 0
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(bytes(HEADER.size))  # filled in once cols is known
+
+            def flush():
+                tiles = b"".join(chunk)
+                counts.append(struct.pack(f"<{rows}I", *row_coins))
+                for match in COIN_PATTERN.finditer(tiles):
+                    row_coins[match.start() % rows] += 1
+                f.write(tiles)
+                chunk.clear()
+
+            for column in columns:
+                if len(column) != rows:
+                    raise ValueError(
+                        f"column {cols} has {len(column)} tiles, expected {rows}")
+                if (invalid := bytes(column).translate(None, VALID_TILES)):
+                    raise ValueError(
+                        f"tile value {invalid[0]} in column {cols} is invalid")
+                chunk.append(bytes(column))
+                cols += 1
+                if len(chunk) == chunk_cols:
+                    flush()
+            if chunk:
+                flush()
+            counts.append(struct.pack(f"<{rows}I", *row_coins))
+
+            data = {**data, "data": {**data.get("data", {})}}
+            data["data"]["world"] = {**data["data"].get("world", {}),
+                                     "rows": rows, "cols": cols}
+            data["data"]["world"].pop("blocks", None)
+            meta = json.dumps(data, separators=(",", ":")).encode()
+            f.write(b"".join(counts))
+            f.write(meta)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION,
+                    rows, cols, chunk_cols, len(meta)))
+        os.replace(tmp, path)
+    except BaseException:
+        # a bad column or an interrupt, leave nothing half written behind
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return cols
+
+
+def compile_yaml(source: str, path: str, chunk_cols: int = STREAM_CHUNK_COLS) -> int:
+    """Converts a yaml level to a streamed one."""
+    with open(source, "rb") as f:
+        data, tiles = Level.compile(levelcache.parse_yaml(f.read()))
+    world = data["data"]["world"]
+    rows, cols = world["rows"], world["cols"]
+    return write(path, data, rows, (tiles[x::cols] for x in range(cols)), chunk_cols)
+
+
+def read_layout(header: bytes, size: int, path: str) -> tuple[int, int, int, int]:
+    """(rows, cols, chunk cols, meta offset) of a `size` byte streamed level, from its header."""
+    if len(header) < HEADER.size:
+        raise ValueError(f"{path} is not a streamed level")
+    magic, version, rows, cols, chunk_cols, meta_len = HEADER.unpack_from(header)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(
+            f"{path} is not a streamed level, or from an unsupported version")
+    chunk_count = -(-cols // chunk_cols) if chunk_cols else 0
+    meta_offset = HEADER.size + rows * cols + (chunk_count + 1) * rows * 4
+    if not chunk_cols or size != meta_offset + meta_len:
+        raise ValueError(f"{path} is truncated")
+    return rows, cols, chunk_cols, meta_offset
+
+
+def read_meta(path: str) -> dict:
+    """The level settings of a streamed level, without mapping its tiles."""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        _, _, _, meta_offset = read_layout(
+            header, os.fstat(f.fileno()).st_size, path)
+        f.seek(meta_offset)
+        return json.loads(f.read())
+
+
+class StreamChunk(NamedTuple):
+    """The resident part of a column chunk."""
+    first_col: int
+    tiles: bytes  # column-major
+    coins: list[tuple[int, Coin]]  # (coin index, sprite), collected or not
+    endpoints: list[Endpoint]
+
+
+class StreamingLevel(Level):
+    """
+    A Level read from a memory mapped .rpls file. Only the column chunks
+    around the player are resident, `follow` pages them in ahead of the
+    player and releases them behind it. Tiles outside the window are paged in
+    on demand, so collisions and rendering never see a hole. Collected coins
+    are a bitset over the whole level, numbered row-major like
+    Level.starting_coins so coin masks and replays match the yaml level.
+    Levels this size have no starting_* lists, tiles or block sprites, tools
+    that need the whole world (BatchSim, the env, the solver) go through
+    tile_grid and tile_cells instead.
+    """
+
+    def __init__(self, path: str):
+        self.completed = False
+        self.path = path
+        with open(path, "rb") as f:
+            # the mapping stays valid after the file is closed
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        rows, cols, chunk_cols, meta_offset = read_layout(
+            self.map[:HEADER.size], len(self.map), path)
+        self.chunk_cols = chunk_cols
+        self.chunk_count = -(-cols // chunk_cols)
+        self.counts = struct.Struct(f"<{rows}I")
+        self.counts_offset = HEADER.size + rows * cols
+
+        self.configure(json.loads(self.map[meta_offset:]))
+
+        totals = self.counts.unpack_from(
+            self.map, meta_offset - self.counts.size)
+        # index of the first coin of each row
+        self.row_starts = list(accumulate(totals, initial=0))[:-1]
+        self.total_coins = sum(totals)
+        self.all_coins = ((1 << self.total_coins) - 1).to_bytes(
+            (self.total_coins + 7) // 8, "little")
+        self.remaining = bytearray(self.all_coins)  # bit i: coin i not collected yet
+
+        self.coins = SpatialGroup()
+        self.endpoints = SpatialGroup()
+        self.active_sprites = SpatialGroup()
+
+        self.chunks: dict[int, StreamChunk] = {}
+        self.window = range(0)
+
+        self.static_layer = ChunkedLayer(self)
+
+    # ==================
+    # Paging
+    # ==================
+
+    def chunk(self, index: int) -> StreamChunk:
+        chunk = self.chunks.get(index)
+        if chunk is None:
+            chunk = self.chunks[index] = self.page_in(index)
+        return chunk
+
+    def page_in(self, index: int) -> StreamChunk:
+        rows = self.rows
+        first_col = index * self.chunk_cols
+        last_col = min(first_col + self.chunk_cols, self.cols)
+        start = HEADER.size + first_col * rows
+        tiles = self.map[start:start + (last_col - first_col) * rows]
+
+        # a coin's index is the coins in the rows above it plus the ones left of it in its row
+        before = self.counts.unpack_from(
+            self.map, self.counts_offset + index * self.counts.size)
+        next_index = [s + b for s, b in zip(self.row_starts, before)]
+
+        coins, endpoints = [], []
+        for match in ENTITY_PATTERN.finditer(tiles):
+            idx = match.start()
+            row = idx % rows
+            x, y = (first_col + idx // rows) * BLOCK_SIZE, row * BLOCK_SIZE
+            if tiles[idx] == TILE_COIN:
+                coins.append((next_index[row], Coin(x, y)))
+                next_index[row] += 1
+            else:
+                endpoints.append(Endpoint(x, y))
+
+        live = [coin for i, coin in coins if self.has_coin(i)]
+        self.coins.add(live)
+        self.endpoints.add(endpoints)
+        self.add_active(live, endpoints)
+        return StreamChunk(first_col, tiles, coins, endpoints)
+
+    def release(self, index: int):
+        chunk = self.chunks.pop(index)
+        self.sync_coins(chunk)
+        for _, coin in chunk.coins:
+            coin.kill()
+        for endpoint in chunk.endpoints:
+            endpoint.kill()
+
+    def follow(self, rect: pg.Rect):
+        width = self.chunk_cols * BLOCK_SIZE
+        first = max((rect.left - STREAM_MARGIN) // width, 0)
+        last = min((rect.right + STREAM_MARGIN) // width, self.chunk_count - 1)
+        window = range(first, last + 1)
+        if window == self.window:
+            return
+        self.window = window
+
+        for index in window:
+            self.chunk(index)
+        for index in list(self.chunks):
+            if index < first - KEEP_STREAM_CHUNKS or index > last + KEEP_STREAM_CHUNKS:
+                self.release(index)
+
+    def add_active(self, *sprites):
+        # new coins and endpoints go under the player, like on a fresh level
+        others = [sprite for sprite in self.active_sprites
+                  if not isinstance(sprite, (Coin, Endpoint))]
+        self.active_sprites.remove(others)
+        self.active_sprites.add(*sprites, others)
+
+    # ==================
+    # Coins
+    # ==================
+
+    def has_coin(self, index: int) -> bool:
+        return bool(self.remaining[index >> 3] >> (index & 7) & 1)
+
+    def sync_coins(self, chunk: StreamChunk):
+        # resident coins are the truth, Player.process_coins just kills them
+        for i, coin in chunk.coins:
+            if coin.alive():
+                self.remaining[i >> 3] |= 1 << (i & 7)
+            else:
+                self.remaining[i >> 3] &= ~(1 << (i & 7))
+
+    def coin_mask(self) -> int:
+        for chunk in self.chunks.values():
+            self.sync_coins(chunk)
+        return int.from_bytes(self.remaining, "little")
+
+    def restore_coins(self, mask: int):
+        self.remaining = bytearray(mask.to_bytes(len(self.all_coins), "little"))
+        coins = [coin for _, chunk in sorted(self.chunks.items())
+                 for i, coin in chunk.coins if self.has_coin(i)]
+        self.coins.empty()
+        self.coins.add(coins)
+        others = [sprite for sprite in self.active_sprites
+                  if not isinstance(sprite, (Coin, Endpoint))]
+        self.active_sprites.empty()
+        self.active_sprites.add(coins, self.endpoints, others)
+
+    def reset(self):
+        self.completed = False
+        for index in list(self.chunks):
+            self.release(index)
+        self.remaining = bytearray(self.all_coins)
+
+        # drops any previous player too
+        self.active_sprites.empty()
+        self.window = range(0)
+        self.follow(pg.Rect(self.player_starting_pos, (BLOCK_SIZE, BLOCK_SIZE)))
+
+    # ==================
+    # Tiles
+    # ==================
+
+    def tile_at(self, x: int, y: int) -> int:
+        if 0 <= x < self.cols and 0 <= y < self.rows:
+            chunk = self.chunk(x // self.chunk_cols)
+            return chunk.tiles[(x - chunk.first_col) * self.rows + y]
+        return TILE_EMPTY
+
+    def blocks_in_rect(self, rect: pg.Rect) -> list[TileHit]:
+        if rect.width <= 0 or rect.height <= 0:
+            return []
+        left = max(rect.left // BLOCK_SIZE, 0)
+        right = min((rect.right - 1) // BLOCK_SIZE, self.cols - 1)
+        top = max(rect.top // BLOCK_SIZE, 0)
+        bottom = min((rect.bottom - 1) // BLOCK_SIZE, self.rows - 1)
+
+        hits = []
+        for y in range(top, bottom + 1):
+            for x in range(left, right + 1):
+                tile = self.tile_at(x, y)
+                if TILE_EMPTY < tile < TILE_COIN:
+                    hits.append(TileHit(pg.Rect(x * BLOCK_SIZE, y * BLOCK_SIZE,
+                                                BLOCK_SIZE, BLOCK_SIZE), tile))
+        return hits
+
+    def block_blits(self, first_col: int, last_col: int) -> list[tuple[pg.Surface, tuple[int, int]]]:
+        blits = []
+        for y in range(self.rows):
+            for x in range(first_col, last_col):
+                tile = self.tile_at(x, y)
+                if TILE_EMPTY < tile < TILE_COIN:
+                    blits.append((block_image(tile),
+                                  (x * BLOCK_SIZE, y * BLOCK_SIZE)))
+        return blits
+
+    def tile_grid(self) -> bytes:
+        # transposed out of the file a row at a time, this reads the whole level
+        start, rows = HEADER.size, self.rows
+        end = start + rows * self.cols
+        return b"".join(self.map[start + row:end:rows] for row in range(rows))
+
+    @cached_property
+    def content_hash(self) -> str:
+        # the file holds the tiles and settings, sha1 reads the mapping a page at a time
+        return hashlib.sha1(self.map).hexdigest()
+
+    def memory_estimate(self) -> int:
+        chunks = self.chunks.values()
+        sprites = sum(len(chunk.coins) + len(chunk.endpoints)
+                      for chunk in chunks)
+        return self.static_layer.memory() + sum(len(chunk.tiles) for chunk in chunks) \
+            + sprites * SPRITE_BYTES + len(self.remaining)
+
+    def close(self):
+        self.map.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="ranny_parkour.streaming", description="build and inspect streamed levels")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="convert a yaml level")
+    build.add_argument("source")
+    build.add_argument("output")
+    build.add_argument("--chunk-cols", type=int, default=STREAM_CHUNK_COLS)
+
+    info = sub.add_parser("info", help="print what is in a streamed level")
+    info.add_argument("levels", nargs="+")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        cols = compile_yaml(args.source, args.output, args.chunk_cols)
+        print(f"wrote {cols} columns to {args.output}")
+        return
+
+    for path in args.levels:
+        level = StreamingLevel(path)
+        print(f"{path}: {level.name} {level.version}, {level.rows}x{level.cols} tiles "
+              f"in {level.chunk_count} chunks of {level.chunk_cols} columns, "
+              f"{level.total_coins} coins, {os.path.getsize(path)} bytes")
+        level.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,18 @@
 import pygame as pg
 
 from . import *
+from .misc import LRUCache
+
+TEXT_CACHE_SIZE = 128
+
+# rendered text is shared, never draw onto a surface that came from here
+text_cache = LRUCache(TEXT_CACHE_SIZE)
+
+
+def render_text(text: str, font: pg.font.Font, antialias=True, color=BLACK, background=None) -> pg.Surface:
+    key = (text, font, antialias, tuple(color),
+           None if background is None else tuple(background))
+    return text_cache.get(key, lambda: font.render(text, antialias, color, background))
 
 # below you will find classes have never been used
 # definitely had plans that was too ambitious lol
@@ -25,7 +37,7 @@ class UIELement(pg.sprite.Sprite):
 class Text(pg.sprite.Sprite):
     def __init__(self, text: str, font: pg.font.Font, antialias=True, color=BLACK, *args, **kwargs) -> pg.Surface:
         super().__init__()
-        self.image = font.render(text, antialias, color, *args)
+        self.image = render_text(text, font, antialias, color, *args)
         self.rect = self.image.get_rect()
 
     def draw(self, surf: pg.Surface):
@@ -1,3 +1,6 @@
 build_targets=("bdist_dmg")
 
+# pack the sprite atlas so it ships prebuilt
+python3 -m ranny_parkour.atlas
+
 python3 setup.py "${build_targets[@]/#/}" 
\ No newline at end of file